@@ -76,6 +76,19 @@ DATABASES = {
     "default": env.db()
 }
 
+# Read-only replicas of the default database, used by exports and admin
+# listings (see `invoices.routers`)
+DATABASE_REPLICAS: List[str] = []
+
+for index, url in enumerate(env.list("DATABASE_REPLICA_URLS", default=[])):
+    alias = f"replica_{index}"
+    DATABASES[alias] = env.db_url_config(url)
+    # tests read the replicas from the test database
+    DATABASES[alias]["TEST"] = {"MIRROR": "default"}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["invoices.routers.ReplicaRouter"]
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -126,3 +139,46 @@ STATIC_URL = "/static/"
 
 # Extra places for collectstatic to find static files.
 STATICFILES_DIRS = (os.path.join(BASE_DIR, "static"),)
+
+# Digital signature of the invoices (see `invoices.signing`): PEM files with
+# the private key and the certificate chain, the signer's certificate first
+INVOICES_SIGNING_KEY = env("INVOICES_SIGNING_KEY", default=None)
+INVOICES_SIGNING_KEY_PASSWORD = env(
+    "INVOICES_SIGNING_KEY_PASSWORD", default=None
+)
+INVOICES_SIGNING_CERTIFICATES = env(
+    "INVOICES_SIGNING_CERTIFICATES", default=None
+)
+
+# Timing of the rendering stages (see `invoices.instrumentation`), renders
+# slower than INVOICES_SLOW_RENDER_SECONDS are logged with their breakdown
+INVOICES_INSTRUMENTATION = env.bool("INVOICES_INSTRUMENTATION", default=False)
+INVOICES_SLOW_RENDER_SECONDS = env.float(
+    "INVOICES_SLOW_RENDER_SECONDS", default=1.0
+)
+
+# Senders of the API users cached by every process (see
+# `SenderManager.get_cached_for_user`)
+INVOICES_SENDER_CACHE_TTL = env.float("INVOICES_SENDER_CACHE_TTL", default=60)
+INVOICES_SENDER_CACHE_SIZE = env.int(
+    "INVOICES_SENDER_CACHE_SIZE", default=1024
+)
+
+# Invoices uploaded with at least this many lines store them in
+# `Invoice.lines` instead of one `Item` per line (never if not set)
+INVOICES_COMPACT_LINES_THRESHOLD = env.int(
+    "INVOICES_COMPACT_LINES_THRESHOLD", default=None
+)
+
+# Responses of the API requests sent with an `Idempotency-Key` header are
+# kept for this many seconds (see `invoices.idempotency`), the expired ones
+# are deleted by the `sweep_idempotency_keys` command
+INVOICES_IDEMPOTENCY_KEY_TTL = env.int(
+    "INVOICES_IDEMPOTENCY_KEY_TTL", default=24 * 60 * 60
+)
+
+# requests sent again with the key of one still running get a 409 response,
+# unless it started more than this many seconds ago (e.g. its process died)
+INVOICES_IDEMPOTENCY_KEY_LOCK_TIMEOUT = env.int(
+    "INVOICES_IDEMPOTENCY_KEY_LOCK_TIMEOUT", default=5 * 60
+)
@@ -2,22 +2,33 @@ from django.utils.translation import ugettext_lazy as _
 from django.http import HttpResponse
 from django.contrib import admin
 
-from .models import Sender, Address, Invoice, Item
-from .utils import zip_files, xml_to_string
+from .instrumentation import log_if_slow, measure
+from .models import (
+    Sender,
+    Address,
+    Invoice,
+    Item,
+    ReceivedInvoice,
+    ReceivedItem,
+)
+from .rendering import stored_invoices_xml
+from .routers import read_from_replica
+from .utils import zip_files
 
 
 def invoice_export_to_xml(modeladmin, request, queryset):
-    if len(queryset) == 1:
-        model = queryset[0]
-        file = xml_to_string(model.to_xml())
+    with measure('admin export') as breakdown, read_from_replica():
+        files = stored_invoices_xml(queryset)
+
+    log_if_slow('admin export', breakdown)
+
+    if len(files) == 1:
+        filename, file = files[0]
         response = HttpResponse(file, content_type='text/xml')
-        response['Content-Disposition'] = f'attachment; filename={model.get_filename()}'
+        response['Content-Disposition'] = f'attachment; filename={filename}'
         response['Content-Length'] = len(file)
         return response
 
-    files = []
-    for model in queryset:
-        files.append((model.get_filename(), xml_to_string(model.to_xml())))
     archive = zip_files(files)
     response = HttpResponse(archive, content_type='application/zip')
     response['Content-Disposition'] = 'attachment; filename=invoices.zip'
@@ -39,6 +50,26 @@ class InvoiceAdmin(admin.ModelAdmin):
     exclude = ('items', )
     inlines = [InvoiceItemInline]
 
+    def changelist_view(self, request, extra_context=None):
+        with read_from_replica():
+            return super().changelist_view(request, extra_context)
+
+
+class ReceivedItemInline(admin.TabularInline):
+    model = ReceivedItem
+    extra = 0
+
+
+@admin.register(ReceivedInvoice)
+class ReceivedInvoiceAdmin(admin.ModelAdmin):
+    inlines = [ReceivedItemInline]
+    list_display = (
+        'invoice_number',
+        'invoice_date',
+        'supplier_denomination',
+        'recipient',
+    )
+
 
 admin.site.register(Sender)
 admin.site.register(Address)
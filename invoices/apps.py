@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class InvoicesConfig(AppConfig):
     name = "invoices"
+
+    def ready(self):
+        from django.conf import settings
+
+        from . import instrumentation, signals  # noqa
+
+        if settings.INVOICES_INSTRUMENTATION:
+            instrumentation.enable()
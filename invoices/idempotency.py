@@ -0,0 +1,148 @@
+"""Support for the `Idempotency-Key` header of the API.
+
+Clients retrying a request (after a timeout, for example) send it again
+with the same key, chosen by them. The first successful response of each
+key is stored for `INVOICES_IDEMPOTENCY_KEY_TTL` seconds and returned to
+the retries as is, without creating or updating the invoices again:
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        ...
+
+The key is reserved before the request runs, so a retry sent while it is
+still running gets a 409 response instead of running it again. A key
+can't be reused for a request with another body. Failed requests are not
+stored, they can be retried with the same key."""
+
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+
+HEADER = "HTTP_IDEMPOTENCY_KEY"
+
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field("key").max_length
+
+
+def request_fingerprint(request) -> str:
+    """Returns the SHA-256 of the path and of the data of the request.
+
+    The parsed data is hashed, so the formatting and the order of the keys
+    of the body don't matter."""
+
+    data = json.dumps(
+        request.data, cls=JSONEncoder, sort_keys=True, separators=(",", ":")
+    )
+
+    return hashlib.sha256(
+        f"{request.method} {request.path}\n{data}".encode("utf-8")
+    ).hexdigest()
+
+
+def _reserve(request, key, fingerprint):
+    """Returns the stored row of the key and whether it was created now.
+
+    The key is stored without response while the request runs, the unique
+    (user, key) constraint lets only one request reserve it."""
+
+    now = timezone.now()
+
+    # replaces the expired response of the same key, if any, or the
+    # reservation of a request that never finished
+    IdempotencyKey.objects.filter(
+        user=request.user, key=key, expires__lte=now
+    ).delete()
+
+    return IdempotencyKey.objects.only(
+        "fingerprint", "status_code", "response"
+    ).get_or_create(
+        user=request.user,
+        key=key,
+        defaults={
+            "fingerprint": fingerprint,
+            "expires": now
+            + timedelta(
+                seconds=settings.INVOICES_IDEMPOTENCY_KEY_LOCK_TIMEOUT
+            ),
+        },
+    )
+
+
+def _store(stored, response):
+    # the reservation is gone if the request ran for longer than the lock
+    # timeout and a retry replaced it, the retry's response is kept then
+    IdempotencyKey.objects.filter(pk=stored.pk).update(
+        status_code=response.status_code,
+        response=response.data,
+        expires=timezone.now()
+        + timedelta(seconds=settings.INVOICES_IDEMPOTENCY_KEY_TTL),
+    )
+
+
+def idempotent(view):
+    """Makes a view method return the stored response of repeated keys."""
+
+    @wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(HEADER)
+
+        if not key:
+            return view(self, request, *args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {
+                    "detail": f"The Idempotency-Key header is longer than "
+                    f"{MAX_KEY_LENGTH} characters."
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        fingerprint = request_fingerprint(request)
+        stored, reserved = _reserve(request, key, fingerprint)
+
+        if not reserved:
+            if stored.fingerprint != fingerprint:
+                return Response(
+                    {
+                        "detail": "The Idempotency-Key was already used for "
+                        "another request."
+                    },
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+
+            if stored.status_code is None:
+                return Response(
+                    {
+                        "detail": "A request with the same Idempotency-Key "
+                        "is still running."
+                    },
+                    status=status.HTTP_409_CONFLICT,
+                )
+
+            return Response(stored.response, status=stored.status_code)
+
+        try:
+            response = view(self, request, *args, **kwargs)
+        except Exception:
+            stored.delete()
+            raise
+
+        if status.is_success(response.status_code):
+            _store(stored, response)
+        else:
+            stored.delete()
+
+        return response
+
+    return wrapper
@@ -0,0 +1,197 @@
+"""Optional timing of the stages of the XML rendering.
+
+The rendering code wraps its stages (database access, dict building, tag
+creation, serialization...) in `timer`. Timings are only collected inside
+`measure`, and only when the instrumentation is enabled (see the
+`INVOICES_INSTRUMENTATION` setting); otherwise `timer` returns a shared
+no-op context manager and costs a function call.
+
+    with measure("export") as breakdown:
+        files = stored_invoices_xml(invoices)
+
+    log_if_slow("export", breakdown)
+
+When a measurement ends its breakdown is passed to the sinks registered
+with `add_sink`, e.g. to send the timings to a metrics system."""
+
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from time import perf_counter
+from typing import Callable, ContextManager, Dict, Iterator, List, Optional
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+_enabled = False
+_local = threading.local()
+
+_NOOP = nullcontext()
+
+
+class Stage:
+    __slots__ = ("calls", "seconds")
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.seconds = 0.0
+
+
+class Breakdown:
+    """Time spent in every stage of a measurement.
+
+    The time of a stage doesn't include the time of the stages nested in
+    it, so the times can be summed up; `other` is the time spent outside
+    any stage."""
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, Stage] = {}
+        self.total = 0.0
+        self._stack: List["_Timer"] = []
+
+    def add(self, stage: str, seconds: float) -> None:
+        try:
+            entry = self.stages[stage]
+        except KeyError:
+            entry = self.stages[stage] = Stage()
+
+        entry.calls += 1
+        entry.seconds += seconds
+
+    @property
+    def other(self) -> float:
+        return self.total - sum(stage.seconds for stage in self.stages.values())
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {"calls": stage.calls, "seconds": stage.seconds}
+            for name, stage in self.stages.items()
+        }
+
+    def __str__(self) -> str:
+        stages = ", ".join(
+            f"{name}={stage.seconds * 1000:.1f}ms/{stage.calls}"
+            for name, stage in sorted(
+                self.stages.items(), key=lambda item: -item[1].seconds
+            )
+        )
+
+        return f"total={self.total * 1000:.1f}ms ({stages})"
+
+
+class _Timer:
+    __slots__ = ("breakdown", "stage", "start", "nested")
+
+    def __init__(self, breakdown: Breakdown, stage: str) -> None:
+        self.breakdown = breakdown
+        self.stage = stage
+
+    def __enter__(self) -> None:
+        self.nested = 0.0
+        self.breakdown._stack.append(self)
+        self.start = perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        elapsed = perf_counter() - self.start
+        stack = self.breakdown._stack
+
+        stack.pop()
+
+        if stack:
+            stack[-1].nested += elapsed
+
+        self.breakdown.add(self.stage, elapsed - self.nested)
+
+
+Sink = Callable[[str, Breakdown], None]
+
+_sinks: List[Sink] = []
+
+
+def add_sink(sink: Sink) -> None:
+    _sinks.append(sink)
+
+
+def remove_sink(sink: Sink) -> None:
+    _sinks.remove(sink)
+
+
+def enable() -> None:
+    global _enabled
+
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def timer(stage: str) -> ContextManager[None]:
+    """Times the block as part of `stage` of the current measurement."""
+
+    if not _enabled:
+        return _NOOP
+
+    breakdown = getattr(_local, "breakdown", None)
+
+    if breakdown is None:
+        return _NOOP
+
+    return _Timer(breakdown, stage)
+
+
+def timed(stage: str) -> Callable[[Callable], Callable]:
+    """Decorator version of `timer`."""
+
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def measure(name: str) -> Iterator[Optional[Breakdown]]:
+    """Collects the timings of the stages run in the block.
+
+    Yields the `Breakdown`, or None if the instrumentation is disabled or
+    a measurement is already running in this thread (the stages are then
+    part of the outer one)."""
+
+    if not _enabled or getattr(_local, "breakdown", None) is not None:
+        yield None
+        return
+
+    breakdown = _local.breakdown = Breakdown()
+    start = perf_counter()
+
+    try:
+        yield breakdown
+    finally:
+        breakdown.total = perf_counter() - start
+        _local.breakdown = None
+
+    for sink in _sinks:
+        sink(name, breakdown)
+
+
+def log_if_slow(name: str, breakdown: Optional[Breakdown]) -> None:
+    """Logs the breakdown if it took more than `INVOICES_SLOW_RENDER_SECONDS`."""
+
+    if breakdown is not None and (
+        breakdown.total >= settings.INVOICES_SLOW_RENDER_SECONDS
+    ):
+        logger.warning("Slow %s: %s", name, breakdown)
@@ -0,0 +1,66 @@
+import zipfile
+
+from django.core.management.base import BaseCommand
+
+from invoices.models import Invoice
+from invoices.rendering import DEFAULT_CHUNK_SIZE, render_invoices
+from invoices.routers import read_from_replica
+from invoices.signing import SIGNATURE_FORMATS
+
+
+class Command(BaseCommand):
+    help = "Renders the XML of the invoices in a zip archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Path of the zip archive")
+        parser.add_argument(
+            "--from-date", help="Only invoices issued on or after this date"
+        )
+        parser.add_argument(
+            "--to-date", help="Only invoices issued on or before this date"
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of processes, defaults to the number of CPUs",
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE
+        )
+        parser.add_argument(
+            "--validate",
+            action="store_true",
+            help="Validate the invoices against the FatturaPA schema",
+        )
+        parser.add_argument(
+            "--sign",
+            choices=SIGNATURE_FORMATS,
+            help="Sign the invoices with the configured key",
+        )
+
+    def handle(self, *args, **options):
+        invoices = Invoice.objects.order_by("invoice_date", "pk")
+
+        if options["from_date"]:
+            invoices = invoices.filter(invoice_date__gte=options["from_date"])
+
+        if options["to_date"]:
+            invoices = invoices.filter(invoice_date__lte=options["to_date"])
+
+        with read_from_replica():
+            ids = list(invoices.values_list("pk", flat=True))
+
+        files = render_invoices(
+            ids,
+            workers=options["workers"],
+            chunk_size=options["chunk_size"],
+            validate=options["validate"],
+            signature=options["sign"],
+        )
+
+        with zipfile.ZipFile(options["output"], "w") as archive:
+            for filename, xml in files:
+                archive.writestr(filename, xml)
+
+        self.stdout.write(f"Exported {len(ids)} invoices")
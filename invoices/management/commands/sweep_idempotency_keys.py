@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from invoices.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Deletes the expired idempotency keys of the API requests."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of keys deleted by each query",
+        )
+
+    def handle(self, *args, **options):
+        deleted = IdempotencyKey.objects.delete_expired(
+            timezone.now(), chunk_size=options["chunk_size"]
+        )
+
+        self.stdout.write(f"Deleted {deleted} expired idempotency keys")
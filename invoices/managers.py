@@ -1,6 +1,355 @@
-from django.db import models
+import threading
+from collections import OrderedDict, defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+from time import monotonic
+
+from django.conf import settings
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import (
+    Case,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    Sum,
+    Value,
+    When,
+)
+
+from .utils import address_fingerprint
+from .xml.types import CENTS, VatSummary
+
+
+ADDRESS_FIELDS = ("address", "postcode", "city", "province", "country_code")
+
+ITEM_FIELDS = ("description", "quantity", "unit_price", "vat_rate")
+
+# items updated by a single query, keeps the parameters under the limits
+UPDATE_BATCH_SIZE = 100
+
+
+class AddressManager(models.Manager):
+    def _insert_missing(self, rows):
+        """Inserts the addresses with `INSERT ... ON CONFLICT DO NOTHING`.
+
+        `rows` are the values of `ADDRESS_FIELDS` and of the fingerprint,
+        the addresses already stored are skipped. Returns the ids of the
+        inserted ones by fingerprint."""
+
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        columns = [
+            self.model._meta.get_field(name).column
+            for name in ADDRESS_FIELDS + ("fingerprint",)
+        ]
+        placeholders = f"({', '.join(['%s'] * len(columns))})"
+        inserted = {}
+
+        batch_size = max(connection.ops.bulk_batch_size(columns, rows), 1)
+
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start : start + batch_size]
+            sql = (
+                f"INSERT INTO {quote(self.model._meta.db_table)} "
+                f"({', '.join(quote(column) for column in columns)}) "
+                f"VALUES {', '.join([placeholders] * len(batch))} "
+                f"ON CONFLICT ({quote('fingerprint')}) DO NOTHING "
+                f"RETURNING {quote(self.model._meta.pk.column)}, "
+                f"{quote('fingerprint')}"
+            )
+
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [value for row in batch for value in row])
+                inserted.update(
+                    (fingerprint, pk) for pk, fingerprint in cursor.fetchall()
+                )
+
+        return inserted
+
+    def get_or_create_by_fingerprint(self, **fields):
+        """Returns the address matching `fields`, creating it if needed.
+
+        Addresses are looked up by fingerprint, so the ones differing only
+        in case or whitespace are considered the same. The address is
+        inserted with `ON CONFLICT DO NOTHING`, which doesn't race with
+        concurrent requests creating the same address. Returns an
+        `(address, created)` tuple like `get_or_create`."""
+
+        fields.setdefault("province", "")
+        fingerprint = address_fingerprint(
+            *(fields[name] for name in ADDRESS_FIELDS)
+        )
+
+        inserted = self._insert_missing(
+            [[fields[name] for name in ADDRESS_FIELDS] + [fingerprint]]
+        )
+
+        if fingerprint not in inserted:
+            return self.get(fingerprint=fingerprint), False
+
+        return (
+            self.model(
+                pk=inserted[fingerprint], fingerprint=fingerprint, **fields
+            ),
+            True,
+        )
+
+    def get_or_create_many_by_fingerprint(self, addresses):
+        """Same as `get_or_create_by_fingerprint`, for many addresses.
+
+        The existing addresses are fetched with one query and the missing
+        ones inserted with another one, plus a query for the ones created
+        meanwhile by concurrent requests, if any. Returns the addresses in
+        the same order as the `addresses` dicts."""
+
+        fingerprints = []
+
+        for fields in addresses:
+            fields.setdefault("province", "")
+            fingerprints.append(
+                address_fingerprint(*(fields[name] for name in ADDRESS_FIELDS))
+            )
+
+        found = {
+            address.fingerprint: address
+            for address in self.filter(fingerprint__in=set(fingerprints))
+        }
+        missing = {}
+
+        for fields, fingerprint in zip(addresses, fingerprints):
+            if fingerprint not in found:
+                missing.setdefault(fingerprint, fields)
+
+        if missing:
+            inserted = self._insert_missing(
+                [
+                    [fields[name] for name in ADDRESS_FIELDS] + [fingerprint]
+                    for fingerprint, fields in missing.items()
+                ]
+            )
+
+            for fingerprint, pk in inserted.items():
+                found[fingerprint] = self.model(
+                    pk=pk, fingerprint=fingerprint, **missing[fingerprint]
+                )
+
+            if len(inserted) < len(missing):
+                found.update(
+                    (address.fingerprint, address)
+                    for address in self.filter(
+                        fingerprint__in=set(missing) - set(inserted)
+                    )
+                )
+
+        return [found[fingerprint] for fingerprint in fingerprints]
+
+
+# user id -> (expiry time, sender), least recently used first
+_senders_by_user: "OrderedDict[int, tuple]" = OrderedDict()
+_senders_lock = threading.Lock()
 
 
 class SenderManager(models.Manager):
     def get_for_user(self, user):
-        return self.get_queryset().get(user=user)
+        return self.get_queryset().select_related("address").get(user=user)
+
+    def get_cached_for_user(self, user):
+        """Like `get_for_user`, but the sender is cached by the process.
+
+        The senders are kept for `INVOICES_SENDER_CACHE_TTL` seconds, at
+        most `INVOICES_SENDER_CACHE_SIZE` of them, and dropped when they or
+        their address are saved in this process; other processes see the
+        changes when the entry expires. The returned sender (and its
+        address) is shared, so it must not be modified."""
+
+        now = monotonic()
+
+        with _senders_lock:
+            cached = _senders_by_user.get(user.pk)
+
+            if cached is not None and cached[0] > now:
+                _senders_by_user.move_to_end(user.pk)
+
+                return cached[1]
+
+        sender = self.get_for_user(user)
+
+        with _senders_lock:
+            _senders_by_user[user.pk] = (
+                now + settings.INVOICES_SENDER_CACHE_TTL,
+                sender,
+            )
+            _senders_by_user.move_to_end(user.pk)
+
+            while len(_senders_by_user) > settings.INVOICES_SENDER_CACHE_SIZE:
+                _senders_by_user.popitem(last=False)
+
+        return sender
+
+
+def invalidate_cached_senders(sender_id=None, address_id=None):
+    """Drops the cached senders with the given id or address."""
+
+    with _senders_lock:
+        for user_id, (_, sender) in list(_senders_by_user.items()):
+            if sender.pk == sender_id or sender.address_id == address_id:
+                del _senders_by_user[user_id]
+
+
+def clear_cached_senders():
+    with _senders_lock:
+        _senders_by_user.clear()
+
+
+class RenderedInvoiceManager(models.Manager):
+    def store(self, rendered):
+        """Stores the rendered XML of many invoices at once.
+
+        `rendered` maps the invoice ids to the XML bytes."""
+
+        objs = [
+            self.model.for_xml(invoice_id, xml)
+            for invoice_id, xml in rendered.items()
+        ]
+
+        try:
+            with transaction.atomic():
+                self.filter(invoice_id__in=rendered.keys()).delete()
+                self.bulk_create(objs)
+        except IntegrityError:
+            # stored at the same time by another request, nothing to do
+            pass
+
+        return objs
+
+
+class IdempotencyKeyManager(models.Manager):
+    def delete_expired(self, now, chunk_size=1000):
+        """Deletes the keys expired at `now`, `chunk_size` at a time.
+
+        Every chunk is deleted by its own query, so the table is never
+        locked for long. Returns the number of deleted keys."""
+
+        deleted = 0
+
+        while True:
+            ids = list(
+                self.filter(expires__lte=now).values_list("pk", flat=True)[
+                    :chunk_size
+                ]
+            )
+
+            if not ids:
+                return deleted
+
+            deleted += self.filter(pk__in=ids).delete()[0]
+
+
+def _vat_summary(vat_rate, taxable_amount):
+    taxable_amount = taxable_amount.quantize(CENTS)
+    tax = (taxable_amount * vat_rate / 100).quantize(
+        CENTS, rounding=ROUND_HALF_UP
+    )
+
+    return VatSummary(vat_rate, taxable_amount, tax)
+
+
+def summarize_lines(lines):
+    """Same as `ItemManager.vat_summaries`, for lines already in memory."""
+
+    amounts = defaultdict(Decimal)
+
+    for line in lines:
+        amounts[line.vat_rate] += line.total_price
+
+    return [
+        _vat_summary(vat_rate, amount)
+        for vat_rate, amount in sorted(amounts.items())
+    ]
+
+
+class ItemManager(models.Manager):
+    def vat_summaries(self, invoice_ids):
+        """Returns the lines totals by VAT rate of many invoices at once.
+
+        The totals are computed by the database with a single grouped
+        query, the result maps every invoice id to its `VatSummary` list
+        (sorted by rate)."""
+
+        amount = ExpressionWrapper(
+            F("unit_price") * F("quantity"),
+            output_field=DecimalField(max_digits=14, decimal_places=2),
+        )
+
+        rows = (
+            self.filter(invoice_id__in=invoice_ids)
+            .values_list("invoice_id", "vat_rate")
+            .annotate(taxable_amount=Sum(amount))
+            .order_by("invoice_id", "vat_rate")
+        )
+
+        summaries = defaultdict(list)
+
+        for invoice_id, vat_rate, taxable_amount in rows:
+            summaries[invoice_id].append(
+                _vat_summary(vat_rate, Decimal(taxable_amount))
+            )
+
+        return {
+            invoice_id: summaries.get(invoice_id, [])
+            for invoice_id in invoice_ids
+        }
+
+    def sync(self, invoice, items):
+        """Makes the items of a saved invoice match the `items` dicts.
+
+        The items are matched to the existing rows by position: only the
+        rows that changed are updated (with a query per `UPDATE_BATCH_SIZE`
+        rows), the new ones are inserted at once and the ones past the end
+        deleted. The items prefetched with the invoice are used, if any.
+
+        Updates, inserts and deletes don't send signals, the caller must
+        drop the rendered XML of the invoice if anything changed, which is
+        returned.
+        """
+
+        existing = {item.row: item for item in invoice.items.all()}
+        changed, created = [], []
+
+        for row, fields in enumerate(items, 1):
+            item = existing.pop(row, None)
+
+            if item is None:
+                created.append(self.model(invoice=invoice, row=row, **fields))
+            elif any(getattr(item, f) != v for f, v in fields.items()):
+                for field, value in fields.items():
+                    setattr(item, field, value)
+
+                changed.append(item)
+
+        for start in range(0, len(changed), UPDATE_BATCH_SIZE):
+            self._update_fields(changed[start : start + UPDATE_BATCH_SIZE])
+
+        if created:
+            self.bulk_create(created)
+
+        if existing:
+            removed = [item.pk for item in existing.values()]
+            self.filter(pk__in=removed).delete()
+
+        return bool(changed or created or existing)
+
+    def _update_fields(self, items):
+        # a single UPDATE setting every row to its own values, which is what
+        # `bulk_update` does from Django 2.2
+        self.filter(pk__in=[item.pk for item in items]).update(
+            **{
+                field: Case(
+                    *(
+                        When(pk=item.pk, then=Value(getattr(item, field)))
+                        for item in items
+                    ),
+                    output_field=self.model._meta.get_field(field),
+                )
+                for field in ITEM_FIELDS
+            }
+        )
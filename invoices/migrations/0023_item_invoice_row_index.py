@@ -0,0 +1,17 @@
+# Generated by Django 2.1.7 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("invoices", "0022_renderedinvoice")]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="item",
+            index=models.Index(
+                fields=["invoice", "row"], name="invoices_it_invoice_4900c4_idx"
+            ),
+        )
+    ]
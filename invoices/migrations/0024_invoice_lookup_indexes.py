@@ -0,0 +1,46 @@
+# Generated by Django 2.1.7 on 2026-10-18 15:50
+
+from django.db import migrations, models
+
+
+def check_duplicate_numbers(apps, schema_editor):
+    Invoice = apps.get_model("invoices", "Invoice")
+
+    duplicates = (
+        Invoice.objects.values("sender_id", "invoice_number")
+        .annotate(count=models.Count("id"))
+        .filter(count__gt=1)
+        .order_by()
+    )
+
+    if duplicates:
+        numbers = ", ".join(
+            f"{duplicate['invoice_number']} (sender {duplicate['sender_id']})"
+            for duplicate in duplicates[:20]
+        )
+
+        raise RuntimeError(
+            "Invoice numbers must be unique for each sender, fix the "
+            f"duplicates before migrating: {numbers}"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("invoices", "0023_item_invoice_row_index")]
+
+    operations = [
+        migrations.RunPython(
+            check_duplicate_numbers, migrations.RunPython.noop
+        ),
+        migrations.AlterUniqueTogether(
+            name="invoice", unique_together={("sender", "invoice_number")}
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["sender", "invoice_date"],
+                name="invoices_in_sender__1ad334_idx",
+            ),
+        ),
+    ]
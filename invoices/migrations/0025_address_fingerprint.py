@@ -0,0 +1,107 @@
+# Generated by Django 2.1.7 on 2026-10-18 16:20
+
+from django.db import migrations, models, transaction
+from django.utils import timezone
+
+from invoices.utils import address_fingerprint
+
+
+CHUNK_SIZE = 1000
+
+
+def _chunks(queryset):
+    last_pk = None
+
+    while True:
+        chunk = queryset.order_by("pk")
+
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+
+        chunk = list(chunk[:CHUNK_SIZE])
+
+        if not chunk:
+            return
+
+        yield chunk
+
+        last_pk = chunk[-1].pk
+
+
+def fill_fingerprints(apps, schema_editor):
+    Address = apps.get_model("invoices", "Address")
+
+    for chunk in _chunks(Address.objects.filter(fingerprint__isnull=True)):
+        with transaction.atomic():
+            for address in chunk:
+                Address.objects.filter(pk=address.pk).update(
+                    fingerprint=address_fingerprint(
+                        address.address,
+                        address.postcode,
+                        address.city,
+                        address.province,
+                        address.country_code,
+                    )
+                )
+
+
+def merge_duplicates(apps, schema_editor):
+    """Keeps the oldest of the addresses with the same fingerprint, the
+    invoices and senders of the others are moved to it."""
+
+    Address = apps.get_model("invoices", "Address")
+    Invoice = apps.get_model("invoices", "Invoice")
+    RenderedInvoice = apps.get_model("invoices", "RenderedInvoice")
+    Sender = apps.get_model("invoices", "Sender")
+
+    duplicates = list(
+        Address.objects.values_list("fingerprint")
+        .annotate(keep=models.Min("id"), count=models.Count("id"))
+        .filter(count__gt=1)
+        .order_by()
+        .values_list("fingerprint", "keep")
+    )
+
+    for start in range(0, len(duplicates), CHUNK_SIZE):
+        with transaction.atomic():
+            for fingerprint, keep in duplicates[start : start + CHUNK_SIZE]:
+                merged = list(
+                    Address.objects.filter(fingerprint=fingerprint)
+                    .exclude(pk=keep)
+                    .values_list("pk", flat=True)
+                )
+
+                RenderedInvoice.objects.filter(
+                    models.Q(invoice__recipient_address__in=merged)
+                    | models.Q(invoice__sender__address__in=merged)
+                ).delete()
+                Invoice.objects.filter(recipient_address__in=merged).update(
+                    recipient_address=keep
+                )
+                Sender.objects.filter(address__in=merged).update(
+                    address=keep, modified=timezone.now()
+                )
+                Address.objects.filter(pk__in=merged).delete()
+
+
+class Migration(migrations.Migration):
+
+    # the addresses are updated in chunks, each in its own transaction
+    atomic = False
+
+    dependencies = [("invoices", "0024_invoice_lookup_indexes")]
+
+    operations = [
+        migrations.AddField(
+            model_name="address",
+            name="fingerprint",
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(fill_fingerprints, migrations.RunPython.noop),
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="address",
+            name="fingerprint",
+            field=models.CharField(editable=False, max_length=64, unique=True),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 2.1.7 on 2026-10-18 17:05
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+import invoices.utils
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("invoices", "0025_address_fingerprint")]
+
+    operations = [
+        migrations.AddField(
+            model_name="invoice",
+            name="lines",
+            field=django.contrib.postgres.fields.jsonb.JSONField(
+                blank=True,
+                null=True,
+                validators=[
+                    invoices.utils.JSONSchemaValidator(
+                        {
+                            "$schema": "http://json-schema.org/draft-04/schema#",
+                            "items": {
+                                "properties": {
+                                    "description": {"type": "string"},
+                                    "quantity": {"type": "number"},
+                                    "row": {"type": "integer"},
+                                    "total_price": {"type": "number"},
+                                    "unit_price": {"type": "number"},
+                                    "vat_rate": {"type": "number"},
+                                },
+                                "required": [
+                                    "row",
+                                    "description",
+                                    "quantity",
+                                    "unit_price",
+                                    "total_price",
+                                    "vat_rate",
+                                ],
+                                "type": "object",
+                            },
+                            "type": "array",
+                        }
+                    )
+                ],
+                verbose_name="Lines",
+            ),
+        )
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 2.1.7 on 2026-10-18 18:30
+
+from django.db import migrations, models
+
+
+def number_invoices(apps, schema_editor):
+    """Numbers the invoices of every sender by date, and stores the last
+    number of each sender."""
+
+    Invoice = apps.get_model("invoices", "Invoice")
+    Sender = apps.get_model("invoices", "Sender")
+
+    connection = schema_editor.connection
+    invoices = connection.ops.quote_name(Invoice._meta.db_table)
+    senders = connection.ops.quote_name(Sender._meta.db_table)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {invoices} SET progressive = numbered.progressive "
+            f"FROM (SELECT id, row_number() OVER ("
+            f"PARTITION BY sender_id ORDER BY invoice_date, id"
+            f") AS progressive FROM {invoices}) AS numbered "
+            f"WHERE {invoices}.id = numbered.id"
+        )
+        cursor.execute(
+            f"UPDATE {senders} SET last_progressive = COALESCE(("
+            f"SELECT MAX(progressive) FROM {invoices} "
+            f"WHERE {invoices}.sender_id = {senders}.id), 0)"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("invoices", "0026_invoice_lines")]
+
+    operations = [
+        migrations.AddField(
+            model_name="invoice",
+            name="progressive",
+            field=models.PositiveIntegerField(
+                editable=False, null=True, verbose_name="Progressive"
+            ),
+        ),
+        migrations.AddField(
+            model_name="sender",
+            name="last_progressive",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(number_invoices, migrations.RunPython.noop),
+    ]
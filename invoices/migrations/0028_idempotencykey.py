@@ -0,0 +1,74 @@
+# Generated by Django 2.1.7 on 2026-10-18 19:05
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import rest_framework.utils.encoders
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("invoices", "0027_progressive"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IdempotencyKey",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=255, verbose_name="Key")),
+                (
+                    "fingerprint",
+                    models.CharField(
+                        max_length=64, verbose_name="Fingerprint"
+                    ),
+                ),
+                (
+                    "status_code",
+                    models.PositiveSmallIntegerField(
+                        null=True, verbose_name="Status code"
+                    ),
+                ),
+                (
+                    "response",
+                    django.contrib.postgres.fields.jsonb.JSONField(
+                        encoder=rest_framework.utils.encoders.JSONEncoder,
+                        null=True,
+                        verbose_name="Response",
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Created"
+                    ),
+                ),
+                (
+                    "expires",
+                    models.DateTimeField(
+                        db_index=True, verbose_name="Expires"
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="User",
+                    ),
+                ),
+            ],
+            options={"unique_together": {("user", "key")}},
+        )
+    ]
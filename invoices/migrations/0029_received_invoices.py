@@ -0,0 +1,240 @@
+# Generated by Django 2.1.7 on 2026-10-18 19:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0028_idempotencykey"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReceivedInvoice",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created",
+                    model_utils.fields.AutoCreatedField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        verbose_name="created",
+                    ),
+                ),
+                (
+                    "modified",
+                    model_utils.fields.AutoLastModifiedField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        verbose_name="modified",
+                    ),
+                ),
+                (
+                    "supplier_country_code",
+                    models.CharField(
+                        max_length=2, verbose_name="Supplier Country Code"
+                    ),
+                ),
+                (
+                    "supplier_code",
+                    models.CharField(
+                        max_length=28, verbose_name="Supplier VAT Number"
+                    ),
+                ),
+                (
+                    "supplier_denomination",
+                    models.CharField(
+                        blank=True,
+                        max_length=161,
+                        verbose_name="Supplier Denomination",
+                    ),
+                ),
+                (
+                    "invoice_number",
+                    models.CharField(
+                        max_length=20, verbose_name="Invoice number"
+                    ),
+                ),
+                (
+                    "invoice_type",
+                    models.CharField(
+                        choices=[
+                            ("TD01", "fattura"),
+                            ("TD02", "acconto/anticipo su fattura"),
+                            ("TD03", "acconto/anticipo su parcella"),
+                            ("TD04", "nota di credito"),
+                            ("TD05", "nota di debito"),
+                            ("TD06", "parcella"),
+                        ],
+                        max_length=4,
+                        verbose_name="Invoice type",
+                    ),
+                ),
+                (
+                    "invoice_currency",
+                    models.CharField(
+                        max_length=3, verbose_name="Invoice currency"
+                    ),
+                ),
+                (
+                    "invoice_date",
+                    models.DateField(verbose_name="Invoice date"),
+                ),
+                (
+                    "invoice_deadline",
+                    models.DateField(
+                        null=True, verbose_name="Invoice deadline"
+                    ),
+                ),
+                (
+                    "invoice_amount",
+                    models.DecimalField(
+                        decimal_places=2,
+                        max_digits=15,
+                        verbose_name="Invoice amount",
+                    ),
+                ),
+                (
+                    "invoice_tax_amount",
+                    models.DecimalField(
+                        decimal_places=2,
+                        max_digits=15,
+                        verbose_name="Invoice tax amount",
+                    ),
+                ),
+                (
+                    "causal",
+                    models.TextField(blank=True, verbose_name="Causal"),
+                ),
+                (
+                    "payment_condition",
+                    models.CharField(
+                        blank=True,
+                        max_length=4,
+                        verbose_name="Payment condition",
+                    ),
+                ),
+                (
+                    "payment_method",
+                    models.CharField(
+                        blank=True, max_length=4, verbose_name="Payment method"
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ReceivedItem",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "row",
+                    models.PositiveSmallIntegerField(
+                        verbose_name="Item number"
+                    ),
+                ),
+                (
+                    "description",
+                    models.CharField(
+                        max_length=1000, verbose_name="Description"
+                    ),
+                ),
+                (
+                    "quantity",
+                    models.DecimalField(
+                        decimal_places=8,
+                        max_digits=21,
+                        null=True,
+                        verbose_name="Quantity",
+                    ),
+                ),
+                (
+                    "unit_price",
+                    models.DecimalField(
+                        decimal_places=8,
+                        max_digits=21,
+                        verbose_name="Unit price",
+                    ),
+                ),
+                (
+                    "total_price",
+                    models.DecimalField(
+                        decimal_places=8,
+                        max_digits=21,
+                        verbose_name="Total price",
+                    ),
+                ),
+                (
+                    "vat_rate",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=6, verbose_name="Tax"
+                    ),
+                ),
+                (
+                    "invoice",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="items",
+                        to="invoices.ReceivedInvoice",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="receivedinvoice",
+            name="recipient",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="received_invoices",
+                to="invoices.Sender",
+                verbose_name="Recipient",
+            ),
+        ),
+        migrations.AddField(
+            model_name="receivedinvoice",
+            name="supplier_address",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT,
+                to="invoices.Address",
+                verbose_name="Supplier Address",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="receiveditem",
+            index=models.Index(
+                fields=["invoice", "row"],
+                name="invoices_re_invoice_515ce9_idx",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="receivedinvoice",
+            unique_together={
+                (
+                    "recipient",
+                    "supplier_country_code",
+                    "supplier_code",
+                    "invoice_number",
+                    "invoice_date",
+                )
+            },
+        ),
+    ]
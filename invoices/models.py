@@ -1,10 +1,14 @@
+import hashlib
 import uuid
 
 from django.conf import settings
-from django.db import models
+from django.contrib.postgres.fields import JSONField
+from django.core.exceptions import ValidationError
+from django.db import models, router, transaction
 from django.utils.translation import ugettext_lazy as _
 
 from model_utils.models import TimeStampedModel
+from rest_framework.utils.encoders import JSONEncoder
 
 from .constants import (
     COUNTRIES,
@@ -17,8 +21,29 @@ from .constants import (
     RETENTION_TYPES,
     RETENTION_CAUSALS,
 )
-from .managers import SenderManager
-from .xml import invoice_to_xml
+from .instrumentation import timer
+from .managers import (
+    AddressManager,
+    IdempotencyKeyManager,
+    ItemManager,
+    RenderedInvoiceManager,
+    SenderManager,
+    summarize_lines,
+)
+from .progressive import allocate_progressive, format_progressive
+from .utils import (
+    PRODUCT_SUMMARY_SCHEMA,
+    JSONSchemaValidator,
+    address_fingerprint,
+    xml_to_bytes,
+)
+from .xml import XML_VERSION, invoice_to_xml, invoice_to_xml_stream
+from .xml.types import ProductSummary
+from .xml.validation import validate_xml
+
+
+# fields of `Item` used to render the lines, in the order of `ProductSummary`
+SUMMARY_FIELDS = ("row", "description", "quantity", "unit_price", "vat_rate")
 
 
 class Address(models.Model):
@@ -29,6 +54,36 @@ class Address(models.Model):
     country_code = models.CharField(
         _("Country Code"), max_length=2, choices=COUNTRIES
     )
+    fingerprint = models.CharField(max_length=64, unique=True, editable=False)
+
+    objects = AddressManager()
+
+    def compute_fingerprint(self):
+        return address_fingerprint(
+            self.address,
+            self.postcode,
+            self.city,
+            self.province,
+            self.country_code,
+        )
+
+    def clean(self):
+        duplicate = (
+            Address.objects.filter(fingerprint=self.compute_fingerprint())
+            .exclude(pk=self.pk)
+            .first()
+        )
+
+        if duplicate is not None:
+            raise ValidationError(
+                _("The same address already exists: %(address)s"),
+                params={"address": duplicate},
+            )
+
+    def save(self, *args, **kwargs):
+        self.fingerprint = self.compute_fingerprint()
+
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return (
@@ -69,6 +124,9 @@ class Sender(TimeStampedModel):
         settings.AUTH_USER_MODEL, on_delete=models.PROTECT
     )
 
+    # last progressive given to an invoice (see `invoices.progressive`)
+    last_progressive = models.PositiveIntegerField(default=0, editable=False)
+
     objects = SenderManager()
 
     def __str__(self):
@@ -87,10 +145,24 @@ class Item(models.Model):
         "Invoice", related_name="items", on_delete=models.CASCADE, null=True
     )
 
+    objects = ItemManager()
+
+    class Meta:
+        indexes = [models.Index(fields=["invoice", "row"])]
+
     @property
     def total_price(self):
         return self.unit_price * self.quantity
 
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+
+        # the items have no delete signals, so that deleting many of them
+        # (or their invoice) takes a single query
+        RenderedInvoice.objects.filter(invoice_id=self.invoice_id).delete()
+
+        return result
+
     def __str__(self):
         return f"{self.row}. {self.description} [{self.quantity}*{self.unit_price}]"
 
@@ -152,27 +224,133 @@ class Invoice(TimeStampedModel):
         Address, models.PROTECT, verbose_name=_("Recipient Address")
     )
 
+    # unique for the sender, see `invoices.progressive`
+    progressive = models.PositiveIntegerField(
+        _("Progressive"), null=True, editable=False
+    )
+
+    # the lines of invoices too large for one `Item` row per line, stored
+    # as `ProductSummary.to_json` objects; if set, the invoice has no items
+    lines = JSONField(
+        _("Lines"),
+        null=True,
+        blank=True,
+        validators=[JSONSchemaValidator(PRODUCT_SUMMARY_SCHEMA)],
+    )
+
+    class Meta:
+        # invoices are looked up (and updated) by number on every upload
+        unique_together = [("sender", "invoice_number")]
+        indexes = [models.Index(fields=["sender", "invoice_date"])]
+
+    def _summary_values(self):
+        # only the values, without building a model instance per item
+        return self.items.order_by("row").values_list(*SUMMARY_FIELDS)
+
     @property
     def invoice_summary(self):
-        result = list()
-        for item in sorted(self.items.iterator(), key=lambda i: i.row):
-            result.append(
-                {
-                    "row": item.row,
-                    "description": item.description,
-                    "quantity": item.quantity,
-                    "unit_price": float(item.unit_price),
-                    "total_price": float(item.total_price),
-                    "vat_rate": float(item.vat_rate),
-                }
-            )
-        return result
+        with timer("summary"):
+            if self.lines is not None:
+                return [ProductSummary.from_json(line) for line in self.lines]
+
+            # use the items fetched with `prefetch_related`, if any
+            if "items" in getattr(self, "_prefetched_objects_cache", {}):
+                return [
+                    ProductSummary(*(getattr(item, f) for f in SUMMARY_FIELDS))
+                    for item in sorted(self.items.all(), key=lambda i: i.row)
+                ]
 
-    def to_xml(self):
-        return invoice_to_xml(self)
+            return [
+                ProductSummary(*values) for values in self._summary_values()
+            ]
+
+    @property
+    def vat_summary(self):
+        """Totals of the lines by VAT rate, see `ItemManager.vat_summaries`."""
+
+        # set by `invoices.xml.fetch_for_rendering` for many invoices at once
+        try:
+            return self._vat_summary
+        except AttributeError:
+            pass
+
+        if self.lines is not None:
+            return summarize_lines(self.invoice_summary)
+
+        return Item.objects.vat_summaries([self.pk])[self.pk]
+
+    def iter_summary(self):
+        """Same as `invoice_summary`, but reads the items one by one."""
+
+        if self.lines is not None:
+            yield from map(ProductSummary.from_json, self.lines)
+            return
+
+        for values in self._summary_values().iterator():
+            yield ProductSummary(*values)
+
+    def to_xml(self, validate=False):
+        return invoice_to_xml(self, validate=validate)
+
+    def validate_xml(self):
+        """Raises `lxml.etree.DocumentInvalid` if the XML is not valid."""
+
+        validate_xml(self.to_xml())
+
+    def to_xml_stream(self, fileobj):
+        invoice_to_xml_stream(self, fileobj)
+
+    def to_xml_bytes(self):
+        """Returns the rendered XML, reusing the stored copy if up to date."""
+
+        # postgres returns a memoryview
+        return bytes(self.get_rendered().xml)
+
+    def get_rendered(self):
+        try:
+            if self.rendered.version == XML_VERSION:
+                return self.rendered
+        except RenderedInvoice.DoesNotExist:
+            pass
+
+        (self.rendered,) = RenderedInvoice.objects.store(
+            {self.pk: xml_to_bytes(self.to_xml())}
+        )
+
+        return self.rendered
+
+    def invalidate_rendered(self):
+        """Drops the stored XML, for changes that don't send signals."""
+
+        RenderedInvoice.objects.filter(invoice=self).delete()
+        self._state.fields_cache.pop("rendered", None)
+
+    def save(self, *args, **kwargs):
+        if self.progressive is not None:
+            return super().save(*args, **kwargs)
+
+        using = kwargs.get("using") or router.db_for_write(
+            Invoice, instance=self
+        )
+
+        try:
+            # the number is taken again if the invoice isn't stored
+            with transaction.atomic(using=using):
+                self.progressive = allocate_progressive(using, self.sender_id)
+                super().save(*args, **kwargs)
+        except Exception:
+            self.progressive = None
+            raise
+
+    def get_progressive(self):
+        return format_progressive(self.progressive)
 
     def get_filename(self):
-        return f"{self.invoice_number}.xml"
+        sender = self.sender
+
+        return (
+            f"{sender.country_code}{sender.code}_{self.get_progressive()}.xml"
+        )
 
     def __str__(self):
         return (
@@ -184,3 +362,158 @@ class Invoice(TimeStampedModel):
             )
             + f"{f': {self.causal}' if self.causal else ''}"
         )
+
+
+class RenderedInvoice(TimeStampedModel):
+    """XML of an invoice, stored the first time it is rendered.
+
+    It is deleted as soon as the invoice, its items, its addresses or its
+    sender change (see `invoices.signals`)."""
+
+    invoice = models.OneToOneField(
+        Invoice,
+        models.CASCADE,
+        primary_key=True,
+        related_name="rendered",
+        verbose_name=_("Invoice"),
+    )
+    version = models.PositiveSmallIntegerField(_("XML version"))
+    xml = models.BinaryField(_("XML"))
+    sha256 = models.CharField(_("SHA-256"), max_length=64, db_index=True)
+
+    objects = RenderedInvoiceManager()
+
+    @classmethod
+    def for_xml(cls, invoice_id, xml):
+        return cls(
+            invoice_id=invoice_id,
+            version=XML_VERSION,
+            xml=xml,
+            sha256=hashlib.sha256(xml).hexdigest(),
+        )
+
+    def __str__(self):
+        return f"{self.invoice} [{self.sha256}]"
+
+
+class ReceivedInvoice(TimeStampedModel):
+    """Invoice received from a supplier, see `invoices.xml.importer`.
+
+    Received invoices are kept apart from the ones sent by the senders, so
+    they are never updated by the API, numbered, rendered or exported."""
+
+    # the sender the invoice is addressed to
+    recipient = models.ForeignKey(
+        Sender,
+        models.PROTECT,
+        related_name="received_invoices",
+        verbose_name=_("Recipient"),
+    )
+
+    supplier_country_code = models.CharField(
+        _("Supplier Country Code"), max_length=2
+    )
+    supplier_code = models.CharField(_("Supplier VAT Number"), max_length=28)
+    supplier_denomination = models.CharField(
+        _("Supplier Denomination"), max_length=161, blank=True
+    )
+    supplier_address = models.ForeignKey(
+        Address, models.PROTECT, verbose_name=_("Supplier Address")
+    )
+
+    invoice_number = models.CharField(_("Invoice number"), max_length=20)
+    invoice_type = models.CharField(
+        _("Invoice type"), max_length=4, choices=INVOICE_TYPES
+    )
+    invoice_currency = models.CharField(_("Invoice currency"), max_length=3)
+    invoice_date = models.DateField(_("Invoice date"))
+    invoice_deadline = models.DateField(_("Invoice deadline"), null=True)
+    invoice_amount = models.DecimalField(
+        _("Invoice amount"), max_digits=15, decimal_places=2
+    )
+    invoice_tax_amount = models.DecimalField(
+        _("Invoice tax amount"), max_digits=15, decimal_places=2
+    )
+    causal = models.TextField(_("Causal"), blank=True)
+    payment_condition = models.CharField(
+        _("Payment condition"), max_length=4, blank=True
+    )
+    payment_method = models.CharField(
+        _("Payment method"), max_length=4, blank=True
+    )
+
+    class Meta:
+        # suppliers number their invoices again every year
+        unique_together = [
+            (
+                "recipient",
+                "supplier_country_code",
+                "supplier_code",
+                "invoice_number",
+                "invoice_date",
+            )
+        ]
+
+    def __str__(self):
+        return (
+            f"[{self.supplier_country_code}{self.supplier_code}/"
+            f"{self.invoice_number}] {self.supplier_denomination}"
+        )
+
+
+class ReceivedItem(models.Model):
+    """Line of a received invoice, with the amounts of the file as is."""
+
+    invoice = models.ForeignKey(
+        ReceivedInvoice, models.CASCADE, related_name="items"
+    )
+    row = models.PositiveSmallIntegerField(_("Item number"))
+    description = models.CharField(_("Description"), max_length=1000)
+    # the lines without quantity are priced as a whole
+    quantity = models.DecimalField(
+        _("Quantity"), max_digits=21, decimal_places=8, null=True
+    )
+    unit_price = models.DecimalField(
+        _("Unit price"), max_digits=21, decimal_places=8
+    )
+    total_price = models.DecimalField(
+        _("Total price"), max_digits=21, decimal_places=8
+    )
+    vat_rate = models.DecimalField(_("Tax"), max_digits=6, decimal_places=2)
+
+    class Meta:
+        indexes = [models.Index(fields=["invoice", "row"])]
+
+    def __str__(self):
+        return f"{self.row}. {self.description} [{self.total_price}]"
+
+
+class IdempotencyKey(models.Model):
+    """Response of an API request sent with an `Idempotency-Key` header.
+
+    Requests sent again with the same key get the same response, without
+    running again (see `invoices.idempotency`)."""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, models.CASCADE, verbose_name=_("User")
+    )
+    key = models.CharField(_("Key"), max_length=255)
+    # SHA-256 of the request, the key can't be reused for another request
+    fingerprint = models.CharField(_("Fingerprint"), max_length=64)
+    # both null while the request is running
+    status_code = models.PositiveSmallIntegerField(
+        _("Status code"), null=True
+    )
+    response = JSONField(_("Response"), encoder=JSONEncoder, null=True)
+    created = models.DateTimeField(_("Created"), auto_now_add=True)
+    expires = models.DateTimeField(_("Expires"), db_index=True)
+
+    objects = IdempotencyKeyManager()
+
+    class Meta:
+        # keys are chosen by the clients, they only need to be unique for
+        # each of them
+        unique_together = [("user", "key")]
+
+    def __str__(self):
+        return f"{self.key} [{self.status_code}]"
@@ -0,0 +1,63 @@
+"""Progressive numbers of the files sent to the SdI.
+
+Every invoice gets a number unique for its sender when it is created,
+used as `ProgressivoInvio` and in the name of the file
+(`IT01234567890_0001A.xml`).
+
+The numbers are taken from a counter on the sender, locked until the
+transaction creating the invoices ends: the invoices of a sender are
+numbered one transaction at a time, and the numbers of a transaction
+that is rolled back are taken again by the next one, so there are no
+gaps."""
+
+from typing import Any, List
+
+
+# the progressive of a file name is at most 5 alphanumeric characters
+PROGRESSIVE_LENGTH = 5
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+MAX_PROGRESSIVE = len(DIGITS) ** PROGRESSIVE_LENGTH - 1
+
+
+def format_progressive(number: int) -> str:
+    """Returns `number` in base 36, as used in the SdI file names."""
+
+    if not 0 < number <= MAX_PROGRESSIVE:
+        raise ValueError(f"Progressive out of range: {number}")
+
+    digits = []
+
+    while number:
+        number, digit = divmod(number, len(DIGITS))
+        digits.append(DIGITS[digit])
+
+    return "".join(reversed(digits)).rjust(PROGRESSIVE_LENGTH, "0")
+
+
+def allocate_progressives(using: str, sender_id: Any, count: int) -> List[int]:
+    """Returns the next `count` progressive numbers of the sender.
+
+    Must be called in the transaction creating the invoices, the sender is
+    locked until it ends."""
+
+    if not count:
+        return []
+
+    from .models import Sender
+
+    # the update doesn't send signals, the cached senders are still valid
+    senders = Sender.objects.using(using).select_for_update().filter(
+        pk=sender_id
+    )
+    last = senders.values_list("last_progressive", flat=True).get()
+    senders.update(last_progressive=last + count)
+
+    return list(range(last + 1, last + count + 1))
+
+
+def allocate_progressive(using: str, sender_id: Any) -> int:
+    """Returns the next progressive number of the sender."""
+
+    (number,) = allocate_progressives(using, sender_id, 1)
+
+    return number
@@ -0,0 +1,136 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import django
+from django.apps import apps
+from django.db import connections
+from django.db.models import QuerySet
+
+from lxml import etree
+
+from .instrumentation import timer
+from .models import Invoice, RenderedInvoice
+from .routers import read_from_primary, read_from_replica
+from .signing import sign_invoice_xml
+from .utils import xml_to_bytes
+from .xml import XML_VERSION, fetch_for_rendering
+
+
+DEFAULT_CHUNK_SIZE = 200
+
+
+def _init_worker():
+    if not apps.ready:
+        # workers started with "spawn" don't inherit the configured django
+        django.setup()
+
+    # never reuse the connections inherited from the parent process, every
+    # worker opens its own
+    connections.close_all()
+
+
+class RenderError(Exception):
+    """An invoice failed to render, unlike lxml errors it can be pickled."""
+
+
+def _render_chunk(
+    ids: Sequence, validate: bool, signature: Optional[str]
+) -> List[Tuple[str, bytes]]:
+    with read_from_replica():
+        invoices = fetch_for_rendering(Invoice.objects.filter(pk__in=ids))
+
+    rendered = {}
+
+    for invoice in invoices:
+        filename = invoice.get_filename()
+
+        try:
+            xml = invoice.to_xml(validate=validate)
+        except etree.DocumentInvalid as e:
+            raise RenderError(f"{filename}: {e}") from None
+
+        if signature:
+            rendered[invoice.pk] = sign_invoice_xml(filename, xml, signature)
+        else:
+            rendered[invoice.pk] = (filename, xml_to_bytes(xml))
+
+    return [rendered[pk] for pk in ids if pk in rendered]
+
+
+def render_invoices(
+    ids: Sequence,
+    workers: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    validate: bool = False,
+    signature: Optional[str] = None,
+) -> Iterator[Tuple[str, bytes]]:
+    """Renders the invoices with the given ids, yields (filename, xml).
+
+    The ids are split in chunks that are rendered by a pool of `workers`
+    processes (one per CPU by default), results are yielded in the same
+    order as the ids. Workers are reused across chunks, so their caches
+    (sender fragments, transliterations, XSD schema) stay warm. With
+    `workers=1` everything is rendered in the current process.
+
+    With a `signature` format (see `invoices.signing`) the files are also
+    signed, every worker loads the signing key only once."""
+
+    chunks = [ids[i : i + chunk_size] for i in range(0, len(ids), chunk_size)]
+
+    if workers == 1:
+        for chunk in chunks:
+            yield from _render_chunk(chunk, validate, signature)
+
+        return
+
+    # forked workers must not share the connections of this process
+    connections.close_all()
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker
+    ) as executor:
+        for files in executor.map(
+            _render_chunk, chunks, repeat(validate), repeat(signature)
+        ):
+            yield from files
+
+
+def stored_invoices_xml(invoices: QuerySet) -> List[Tuple[str, bytes]]:
+    """Same as `invoices_to_xml`, but reuses the stored XML of the invoices.
+
+    Only the invoices without an up to date copy are rendered, and their
+    XML is stored for the next time. They are rendered from the primary,
+    also in `read_from_replica` blocks, so that the stored XML is never
+    rendered from the data of a replica lagging behind."""
+
+    with timer("query"):
+        invoices = list(invoices.select_related("rendered", "sender"))
+
+    stored = {}
+
+    for invoice in invoices:
+        try:
+            if invoice.rendered.version == XML_VERSION:
+                stored[invoice.pk] = bytes(invoice.rendered.xml)
+        except RenderedInvoice.DoesNotExist:
+            pass
+
+    missing = [invoice.pk for invoice in invoices if invoice.pk not in stored]
+
+    if missing:
+        with read_from_primary():
+            rendered = {
+                invoice.pk: xml_to_bytes(invoice.to_xml())
+                for invoice in fetch_for_rendering(
+                    Invoice.objects.filter(pk__in=missing)
+                )
+            }
+
+        with timer("store"):
+            RenderedInvoice.objects.store(rendered)
+        stored.update(rendered)
+
+    return [
+        (invoice.get_filename(), stored[invoice.pk]) for invoice in invoices
+    ]
@@ -0,0 +1,93 @@
+"""Sends the heavy read-only workloads to the database replicas.
+
+Reads go to the primary (`default`) database unless they run in a
+`read_from_replica` block, in which case a replica chosen at random
+(from `DATABASE_REPLICAS`, see `DATABASE_REPLICA_URLS`) is used until the
+block ends, so all its reads see the same data:
+
+    with read_from_replica():
+        files = stored_invoices_xml(invoices)
+
+Replicas lag behind the primary, so after a write the reads of the same
+request go to the primary too, even in `read_from_replica` blocks, and
+so do the reads in `read_from_primary` blocks. The state is reset at the
+start and at the end of every request (see `invoices.signals`); commands
+stay on the primary after their first write."""
+
+import random
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+_local = threading.local()
+
+
+@contextmanager
+def read_from_replica() -> Iterator[None]:
+    depth = getattr(_local, "depth", 0)
+    replica = getattr(_local, "replica", None)
+
+    if not depth and settings.DATABASE_REPLICAS:
+        _local.replica = random.choice(settings.DATABASE_REPLICAS)
+
+    _local.depth = depth + 1
+
+    try:
+        yield
+    finally:
+        _local.depth = depth
+        _local.replica = replica
+
+
+@contextmanager
+def read_from_primary() -> Iterator[None]:
+    """Reads from the primary, even in a `read_from_replica` block.
+
+    For the reads whose results are written back, which must not come
+    from a replica lagging behind."""
+
+    depth = getattr(_local, "depth", 0)
+    _local.depth = 0
+
+    try:
+        yield
+    finally:
+        _local.depth = depth
+
+
+def reset() -> None:
+    """Forgets the writes done so far, called at every request."""
+
+    _local.written = False
+
+
+def get_replica() -> Optional[str]:
+    """Returns the alias of the replica to read from, if any."""
+
+    if not getattr(_local, "depth", 0) or getattr(_local, "written", False):
+        return None
+
+    return getattr(_local, "replica", None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return get_replica() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # read your writes: the next reads must see this one
+        _local.written = True
+
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas have the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replicas are migrated by the replication
+        return db not in settings.DATABASE_REPLICAS
@@ -1,18 +1,209 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+
 from rest_framework import serializers
 
-from .models import Invoice, Address, Sender, Item
+from .models import Invoice, Address, Sender, Item, RenderedInvoice
+from .progressive import allocate_progressives
+from .xml import XML_VERSION
+from .xml.types import ProductSummary
 
 
 class AddressSerializer(serializers.ModelSerializer):
     class Meta:
         model = Address
-        fields = "__all__"
+        # computed from the other fields, only used to find the address
+        exclude = ["fingerprint"]
+
+
+class ItemListSerializer(serializers.ListSerializer):
+    def get_attribute(self, invoice):
+        # reads the lines stored on the invoice, or only the values of the
+        # items, without building a model instance per item
+        return invoice.invoice_summary
 
 
 class ItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = Item
         fields = ["description", "quantity", "unit_price", "vat_rate"]
+        list_serializer_class = ItemListSerializer
+
+
+def compact_lines(items):
+    """Returns the `lines` of an invoice with `items`, if they are many."""
+
+    threshold = settings.INVOICES_COMPACT_LINES_THRESHOLD
+
+    if threshold is None or len(items) < threshold:
+        return None
+
+    return [
+        ProductSummary(row=index + 1, **item).to_json()
+        for index, item in enumerate(items)
+    ]
+
+
+def set_invoice_fields(invoice, data):
+    """Sets the fields of the invoice, returns whether any of them changed.
+
+    `data` also has the `recipient_address` and the `lines` of the invoice.
+    """
+
+    address = data["recipient_address"]
+    changed = invoice.recipient_address_id != address.pk
+    invoice.recipient_address = address
+
+    for field, value in data.items():
+        if field != "recipient_address" and getattr(invoice, field) != value:
+            setattr(invoice, field, value)
+            changed = True
+
+    return changed
+
+
+def lock_invoice(sender, invoice_number):
+    """Returns the invoice of the sender with the number, locked, if any."""
+
+    return (
+        Invoice.objects.select_for_update()
+        .filter(sender=sender, invoice_number=invoice_number)
+        .first()
+    )
+
+
+def save_invoice(invoice, changed, items):
+    """Saves the changes of an invoice and of its items, if any.
+
+    Only the items that changed are written (see `ItemManager.sync`), so
+    uploading the same invoice again doesn't write anything and keeps its
+    rendered XML."""
+
+    if changed:
+        invoice.save()
+
+    if invoice.lines is not None:
+        items = []
+
+    if Item.objects.sync(invoice, items) and not changed:
+        # saving the invoice already dropped it
+        invoice.invalidate_rendered()
+
+
+class InvoiceListSerializer(serializers.ListSerializer):
+    """Creates (or updates) many invoices of the sender at once.
+
+    The invoices are written with a few queries in a single transaction:
+    either all of them are stored or, if any is invalid, none of them, with
+    the errors of each invoice at its position in the response."""
+
+    def to_internal_value(self, data):
+        data = super().to_internal_value(data)
+        numbers = Counter(invoice["invoice_number"] for invoice in data)
+
+        if any(count > 1 for count in numbers.values()):
+            raise serializers.ValidationError(
+                [
+                    (
+                        {"invoice_number": ["Duplicated invoice number."]}
+                        if numbers[invoice["invoice_number"]] > 1
+                        else {}
+                    )
+                    for invoice in data
+                ]
+            )
+
+        return data
+
+    def create(self, validated_data):
+        sender = Sender.objects.get_cached_for_user(
+            self.context["request"].user
+        )
+        using = router.db_for_write(Invoice)
+
+        with transaction.atomic(using=using):
+            addresses = Address.objects.get_or_create_many_by_fingerprint(
+                [data.pop("recipient_address") for data in validated_data]
+            )
+            existing = {
+                invoice.invoice_number: invoice
+                for invoice in Invoice.objects.select_for_update()
+                .filter(
+                    sender=sender,
+                    invoice_number__in=[
+                        data["invoice_number"] for data in validated_data
+                    ],
+                )
+                .prefetch_related("items")
+            }
+
+            invoices, items = [], {}
+
+            for data, address in zip(validated_data, addresses):
+                number = data["invoice_number"]
+                invoice = existing.get(number)
+
+                if invoice is None:
+                    invoice = Invoice(sender=sender)
+
+                items[number] = data.pop("items", [])
+
+                changed = set_invoice_fields(
+                    invoice,
+                    dict(
+                        data,
+                        recipient_address=address,
+                        lines=compact_lines(items[number]),
+                    ),
+                )
+
+                if invoice.pk is not None:
+                    save_invoice(invoice, changed, items[number])
+
+                invoices.append(invoice)
+
+            created = [invoice for invoice in invoices if invoice.pk is None]
+            progressives = allocate_progressives(
+                using, sender.pk, len(created)
+            )
+
+            for invoice, progressive in zip(created, progressives):
+                invoice.progressive = progressive
+
+            Invoice.objects.bulk_create(created)
+
+            if any(invoice.pk is None for invoice in created):
+                # only postgres returns the ids of the inserted rows
+                ids = dict(
+                    Invoice.objects.filter(
+                        sender=sender,
+                        invoice_number__in=[
+                            invoice.invoice_number for invoice in created
+                        ],
+                    ).values_list("invoice_number", "pk")
+                )
+
+                for invoice in created:
+                    invoice.pk = ids[invoice.invoice_number]
+
+            Item.objects.bulk_create(
+                Item(invoice=invoice, row=index + 1, **item)
+                for invoice in created
+                if invoice.lines is None
+                for index, item in enumerate(items[invoice.invoice_number])
+            )
+
+        # the response lists the items and the hash of the stored XML of the
+        # invoices, fetched at once (see `InvoiceSerializer.get_xml_sha256`)
+        fetched = (
+            Invoice.objects.select_related("recipient_address", "rendered")
+            .prefetch_related("items")
+            .in_bulk([invoice.pk for invoice in invoices])
+        )
+
+        return [fetched[invoice.pk] for invoice in invoices]
 
 
 class InvoiceSerializer(serializers.ModelSerializer):
@@ -20,6 +211,7 @@ class InvoiceSerializer(serializers.ModelSerializer):
     items = ItemSerializer(many=True)
     recipient_code = serializers.CharField(required=False, allow_blank=True)
     recipient_pec = serializers.EmailField(required=False, allow_blank=True)
+    xml_sha256 = serializers.SerializerMethodField()
 
     class Meta:
         model = Invoice
@@ -44,36 +236,61 @@ class InvoiceSerializer(serializers.ModelSerializer):
             "recipient_address",
             "payment_condition",
             "payment_method",
+            "xml_sha256",
         ]
+        list_serializer_class = InvoiceListSerializer
 
-    # TODO: atomic
     def create(self, validated_data):
-        sender = Sender.objects.get_for_user(self.context["request"].user)
-
-        recipient_address, _ = Address.objects.get_or_create(
-            **validated_data["recipient_address"]
+        sender = Sender.objects.get_cached_for_user(
+            self.context["request"].user
         )
+        items = validated_data.pop("items", [])
 
-        validated_data["recipient_address"] = recipient_address
+        with transaction.atomic():
+            address, _ = Address.objects.get_or_create_by_fingerprint(
+                **validated_data["recipient_address"]
+            )
 
-        items = validated_data.pop("items", [])
+            validated_data["recipient_address"] = address
+            validated_data["lines"] = compact_lines(items)
 
-        invoice_number = validated_data.pop("invoice_number")
+            number = validated_data["invoice_number"]
+            invoice = lock_invoice(sender, number)
 
-        invoice, created = Invoice.objects.update_or_create(
-            sender=sender,
-            invoice_number=invoice_number,
-            defaults=validated_data,
-        )
+            if invoice is None:
+                # the cached sender is only used to find the invoice, it can
+                # be stale: the one rendered in the XML is fetched again
+                invoice = Invoice(sender_id=sender.pk)
+                changed = set_invoice_fields(invoice, validated_data)
 
-        if not created:
-            invoice.items.all().delete()
+                try:
+                    with transaction.atomic():
+                        save_invoice(invoice, changed, items)
 
-        for index, item in enumerate(items):
-            Item.objects.create(row=index + 1, invoice=invoice, **item)
+                    return invoice
+                except IntegrityError:
+                    # created by a concurrent upload of the same invoice
+                    invoice = lock_invoice(sender, number)
+
+                    if invoice is None:
+                        raise
+
+            changed = set_invoice_fields(invoice, validated_data)
+            save_invoice(invoice, changed, items)
 
         return invoice
 
+    def get_xml_sha256(self, invoice):
+        # the hash tells clients whether a re-upload changed the document;
+        # only the stored XML is hashed, the invoices are rendered when they
+        # are downloaded and not while they are uploaded
+        try:
+            rendered = invoice.rendered
+        except RenderedInvoice.DoesNotExist:
+            return None
+
+        return rendered.sha256 if rendered.version == XML_VERSION else None
+
     def validate(self, data):
         denomination = data.get("recipient_denomination")
         first_name = data.get("recipient_first_name")
@@ -0,0 +1,53 @@
+from django.core.signals import request_finished, request_started
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import routers
+from .managers import invalidate_cached_senders
+from .models import Address, Invoice, Item, RenderedInvoice, Sender
+from .xml.cache import (
+    invalidate_address_fragments,
+    invalidate_sender_fragments,
+)
+
+
+@receiver([post_save, post_delete], sender=Sender)
+def sender_changed(sender, instance, **kwargs):
+    invalidate_sender_fragments(instance.pk)
+    invalidate_cached_senders(sender_id=instance.pk)
+
+    RenderedInvoice.objects.filter(invoice__sender=instance).delete()
+
+
+@receiver([post_save, post_delete], sender=Address)
+def address_changed(sender, instance, **kwargs):
+    invalidate_address_fragments(instance.pk)
+    invalidate_cached_senders(address_id=instance.pk)
+
+    # the fragments cached by other processes are keyed on the sender
+    # modified timestamp, bump it so they get rebuilt too
+    Sender.objects.filter(address=instance).update(modified=timezone.now())
+
+    RenderedInvoice.objects.filter(
+        Q(invoice__recipient_address=instance)
+        | Q(invoice__sender__address=instance)
+    ).delete()
+
+
+@receiver(post_save, sender=Invoice)
+def invoice_changed(sender, instance, **kwargs):
+    instance.invalidate_rendered()
+
+
+# deletes are not handled here: without receivers the items are deleted
+# with a single query (see `Item.delete` and `ItemManager.sync`)
+@receiver(post_save, sender=Item)
+def item_changed(sender, instance, **kwargs):
+    RenderedInvoice.objects.filter(invoice_id=instance.invoice_id).delete()
+
+
+@receiver([request_started, request_finished])
+def request_boundary(sender, **kwargs):
+    routers.reset()
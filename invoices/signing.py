@@ -0,0 +1,309 @@
+"""Digital signature of the invoices, as required by the SdI.
+
+Two formats are supported: enveloped XAdES-BES (the signature is added to
+the XML, the file keeps the `.xml` extension) and CAdES (the XML is wrapped
+in a CMS envelope, the file gets the `.p7m` extension).
+
+The private key and the certificates are read from the files configured in
+the settings the first time they are needed and then shared by the whole
+process, so workers signing many invoices only load them once."""
+
+import base64
+import hashlib
+import threading
+from datetime import datetime, timezone
+from typing import List, NamedTuple, Optional, Tuple, Union, cast
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import (
+    decode_dss_signature,
+)
+from cryptography.hazmat.primitives.serialization import pkcs7
+from lxml import etree
+
+from .instrumentation import timed
+from .utils import xml_to_bytes
+from .xml import NAMESPACE_MAP
+from .xml.utils import indent
+
+
+XADES = "xades"
+CADES = "cades"
+
+SIGNATURE_FORMATS = (XADES, CADES)
+
+DS = NAMESPACE_MAP["ds"]
+XADES_NAMESPACE = "http://uri.etsi.org/01903/v1.3.2#"
+
+C14N = "http://www.w3.org/TR/2001/REC-xml-c14n-20010315"
+ENVELOPED_SIGNATURE = "http://www.w3.org/2000/09/xmldsig#enveloped-signature"
+SHA256 = "http://www.w3.org/2001/04/xmlenc#sha256"
+RSA_SHA256 = "http://www.w3.org/2001/04/xmldsig-more#rsa-sha256"
+ECDSA_SHA256 = "http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha256"
+SIGNED_PROPERTIES_TYPE = "http://uri.etsi.org/01903#SignedProperties"
+
+SIGNATURE_ID = "Signature1"
+SIGNED_PROPERTIES_ID = "SignedProperties1"
+
+
+PrivateKey = Union[rsa.RSAPrivateKey, ec.EllipticCurvePrivateKey]
+
+
+class SigningMaterial(NamedTuple):
+    private_key: PrivateKey
+    # the signer's certificate comes first
+    certificates: List[x509.Certificate]
+
+
+_material: Optional[SigningMaterial] = None
+_material_lock = threading.Lock()
+
+
+def load_signing_material(
+    key_path: str, certificates_path: str, password: Optional[str] = None
+) -> SigningMaterial:
+    with open(key_path, "rb") as f:
+        private_key = serialization.load_pem_private_key(
+            f.read(), password.encode() if password else None
+        )
+
+    if not isinstance(
+        private_key, (rsa.RSAPrivateKey, ec.EllipticCurvePrivateKey)
+    ):
+        raise ValueError(f"Unsupported key type {type(private_key).__name__}")
+
+    with open(certificates_path, "rb") as f:
+        certificates = x509.load_pem_x509_certificates(f.read())
+
+    return SigningMaterial(private_key, certificates)
+
+
+def get_signing_material() -> SigningMaterial:
+    """Returns the key and certificates configured in the settings.
+
+    They are loaded the first time they are needed and then shared by the
+    whole process."""
+
+    global _material
+
+    if _material is None:
+        with _material_lock:
+            if _material is None:
+                if not (
+                    settings.INVOICES_SIGNING_KEY
+                    and settings.INVOICES_SIGNING_CERTIFICATES
+                ):
+                    raise ImproperlyConfigured(
+                        "INVOICES_SIGNING_KEY and INVOICES_SIGNING_CERTIFICATES"
+                        " are required to sign the invoices"
+                    )
+
+                _material = load_signing_material(
+                    settings.INVOICES_SIGNING_KEY,
+                    settings.INVOICES_SIGNING_CERTIFICATES,
+                    settings.INVOICES_SIGNING_KEY_PASSWORD,
+                )
+
+    return _material
+
+
+def clear_signing_material() -> None:
+    global _material
+
+    with _material_lock:
+        _material = None
+
+
+def sign_cades(
+    data: bytes, material: Optional[SigningMaterial] = None
+) -> bytes:
+    """Returns the content of the `.p7m` file of `data`."""
+
+    material = material or get_signing_material()
+    signer, *chain = material.certificates
+
+    builder = (
+        pkcs7.PKCS7SignatureBuilder()
+        .set_data(data)
+        .add_signer(signer, material.private_key, hashes.SHA256())
+    )
+
+    for certificate in chain:
+        builder = builder.add_certificate(certificate)
+
+    # binary mode, the XML must be enveloped as is
+    return builder.sign(
+        serialization.Encoding.DER, [pkcs7.PKCS7Options.Binary]
+    )
+
+
+def _c14n(element: etree._Element) -> bytes:
+    return cast(bytes, etree.tostring(element, method="c14n"))
+
+
+def _digest(data: bytes) -> str:
+    return base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+
+def _get_signature_method(private_key: PrivateKey) -> str:
+    if isinstance(private_key, rsa.RSAPrivateKey):
+        return RSA_SHA256
+
+    return ECDSA_SHA256
+
+
+def _sign(private_key: PrivateKey, data: bytes) -> bytes:
+    if isinstance(private_key, rsa.RSAPrivateKey):
+        return private_key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+
+    r, s = decode_dss_signature(
+        private_key.sign(data, ec.ECDSA(hashes.SHA256()))
+    )
+    size = (private_key.curve.key_size + 7) // 8
+
+    # xmldsig wants the raw concatenation of r and s
+    return r.to_bytes(size, "big") + s.to_bytes(size, "big")
+
+
+def _ds(parent: etree._Element, tag: str, **attrib: str) -> etree._Element:
+    return etree.SubElement(parent, f"{{{DS}}}{tag}", attrib)
+
+
+def _xades(parent: etree._Element, tag: str, **attrib: str) -> etree._Element:
+    return etree.SubElement(parent, f"{{{XADES_NAMESPACE}}}{tag}", attrib)
+
+
+def _add_reference(
+    signed_info: etree._Element,
+    digest: str,
+    uri: str,
+    transforms: Tuple[str, ...] = (),
+    **attrib: str,
+) -> None:
+    reference = _ds(signed_info, "Reference", URI=uri, **attrib)
+
+    if transforms:
+        transforms_tag = _ds(reference, "Transforms")
+
+        for algorithm in transforms:
+            _ds(transforms_tag, "Transform", Algorithm=algorithm)
+
+    _ds(reference, "DigestMethod", Algorithm=SHA256)
+    _ds(reference, "DigestValue").text = digest
+
+
+def _add_signed_properties(
+    signature: etree._Element, certificate: x509.Certificate
+) -> etree._Element:
+    obj = _ds(signature, "Object")
+
+    qualifying_properties = etree.SubElement(
+        obj,
+        f"{{{XADES_NAMESPACE}}}QualifyingProperties",
+        {"Target": f"#{SIGNATURE_ID}"},
+        nsmap={"xades": XADES_NAMESPACE},
+    )
+    signed_properties = _xades(
+        qualifying_properties, "SignedProperties", Id=SIGNED_PROPERTIES_ID
+    )
+    signature_properties = _xades(
+        signed_properties, "SignedSignatureProperties"
+    )
+
+    _xades(signature_properties, "SigningTime").text = datetime.now(
+        timezone.utc
+    ).isoformat(timespec="seconds")
+
+    cert = _xades(_xades(signature_properties, "SigningCertificate"), "Cert")
+    cert_digest = _xades(cert, "CertDigest")
+    _ds(cert_digest, "DigestMethod", Algorithm=SHA256)
+    _ds(cert_digest, "DigestValue").text = _digest(
+        certificate.public_bytes(serialization.Encoding.DER)
+    )
+
+    issuer_serial = _xades(cert, "IssuerSerial")
+    _ds(issuer_serial, "X509IssuerName").text = (
+        certificate.issuer.rfc4514_string()
+    )
+    _ds(issuer_serial, "X509SerialNumber").text = str(
+        certificate.serial_number
+    )
+
+    return signed_properties
+
+
+def sign_xades(
+    xml: etree._Element, material: Optional[SigningMaterial] = None
+) -> etree._Element:
+    """Adds an enveloped XAdES-BES signature to the root of `xml`.
+
+    The signature is appended to `xml`, which is also returned. Since the
+    whitespace is signed too, the result must be serialized as is (without
+    `pretty_print`)."""
+
+    material = material or get_signing_material()
+    signer = material.certificates[0]
+
+    # the enveloped-signature transform removes the signature, so the
+    # document is digested before adding it
+    document_digest = _digest(_c14n(xml))
+
+    signature = _ds(xml, "Signature", Id=SIGNATURE_ID)
+    signed_info = _ds(signature, "SignedInfo")
+    signature_value = _ds(signature, "SignatureValue")
+
+    x509_data = _ds(_ds(signature, "KeyInfo"), "X509Data")
+
+    for certificate in material.certificates:
+        _ds(x509_data, "X509Certificate").text = base64.b64encode(
+            certificate.public_bytes(serialization.Encoding.DER)
+        ).decode()
+
+    signed_properties = _add_signed_properties(signature, signer)
+
+    _ds(signed_info, "CanonicalizationMethod", Algorithm=C14N)
+    _ds(
+        signed_info,
+        "SignatureMethod",
+        Algorithm=_get_signature_method(material.private_key),
+    )
+
+    _add_reference(
+        signed_info, document_digest, "", transforms=(ENVELOPED_SIGNATURE,)
+    )
+    _add_reference(
+        signed_info,
+        _digest(_c14n(signed_properties)),
+        f"#{SIGNED_PROPERTIES_ID}",
+        Type=SIGNED_PROPERTIES_TYPE,
+    )
+
+    signature_value.text = base64.b64encode(
+        _sign(material.private_key, _c14n(signed_info))
+    ).decode()
+
+    return xml
+
+
+@timed("sign")
+def sign_invoice_xml(
+    filename: str, xml: etree._Element, signature_format: str
+) -> Tuple[str, bytes]:
+    """Signs the XML of an invoice, returns the signed (filename, file)."""
+
+    if signature_format == XADES:
+        # the document is indented before being signed, pretty printing it
+        # afterwards would invalidate the signature
+        indent(xml)
+
+        return filename, cast(bytes, etree.tostring(sign_xades(xml)))
+
+    if signature_format == CADES:
+        return f"{filename}.p7m", sign_cades(xml_to_bytes(xml))
+
+    raise ValueError(f"Unknown signature format {signature_format}")
@@ -1,35 +1,37 @@
+from django.core.exceptions import ValidationError
 from django.utils.deconstruct import deconstructible
-from jsonschema import validate
+from jsonschema import exceptions, validate
 
 from io import BytesIO
 from lxml import etree
+import hashlib
 import zipfile
 
+from .instrumentation import timed
+
 
 PRODUCT_SUMMARY_SCHEMA = {
     "$schema": "http://json-schema.org/draft-04/schema#",
     "type": "array",
-    "items": [
-        {
-            "type": "object",
-            "properties": {
-                "row": {"type": "integer"},
-                "description": {"type": "string"},
-                "quantity": {"type": "number"},
-                "unit_price": {"type": "number"},
-                "total_price": {"type": "number"},
-                "vat_rate": {"type": "number"},
-            },
-            "required": [
-                "row",
-                "description",
-                "quantity",
-                "unit_price",
-                "total_price",
-                "vat_rate",
-            ],
-        }
-    ],
+    "items": {
+        "type": "object",
+        "properties": {
+            "row": {"type": "integer"},
+            "description": {"type": "string"},
+            "quantity": {"type": "number"},
+            "unit_price": {"type": "number"},
+            "total_price": {"type": "number"},
+            "vat_rate": {"type": "number"},
+        },
+        "required": [
+            "row",
+            "description",
+            "quantity",
+            "unit_price",
+            "total_price",
+            "vat_rate",
+        ],
+    },
 }
 
 
@@ -39,12 +41,29 @@ class JSONSchemaValidator:
         self.schema = schema
 
     def __call__(self, value):
-        validate(value, self.schema)
+        try:
+            validate(value, self.schema)
+        except exceptions.ValidationError as e:
+            raise ValidationError(e.message)
 
     def __eq__(self, other):
         return self.schema == other.schema
 
 
+def address_fingerprint(address, postcode, city, province, country_code):
+    """Returns the hash identifying an address.
+
+    Case and whitespace are ignored, so the same address typed twice in
+    slightly different ways gets the same fingerprint."""
+
+    parts = (address, postcode, city, province or "", country_code)
+    normalized = "\x1f".join(
+        " ".join(part.split()).casefold() for part in parts
+    )
+
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
 def zip_files(files):
     outfile = BytesIO()
     with zipfile.ZipFile(outfile, 'w') as zf:
@@ -53,5 +72,10 @@ def zip_files(files):
     return outfile.getvalue()
 
 
+@timed("serialize")
+def xml_to_bytes(xml):
+    return etree.tostring(xml, pretty_print=True)
+
+
 def xml_to_string(xml):
-    return etree.tostring(xml, pretty_print=True).decode('utf-8')
+    return xml_to_bytes(xml).decode('utf-8')
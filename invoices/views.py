@@ -1,6 +1,10 @@
-from rest_framework import mixins, viewsets
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 
+from .idempotency import idempotent
+from .instrumentation import log_if_slow, measure
 from .models import Invoice
 from .serializers import InvoiceSerializer
 
@@ -9,3 +13,28 @@ class InvoicesViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
     queryset = Invoice.objects.all()
     serializer_class = InvoiceSerializer
     permission_classes = [IsAuthenticated]
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        with measure("invoice creation") as breakdown:
+            response = super().create(request, *args, **kwargs)
+
+        log_if_slow("invoice creation", breakdown)
+
+        return response
+
+    @action(detail=False, methods=["post"])
+    @idempotent
+    def bulk(self, request):
+        """Creates the list of invoices of the request, see
+        `InvoiceListSerializer`."""
+
+        with measure("bulk invoice creation") as breakdown:
+            serializer = self.get_serializer(data=request.data, many=True)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            data = serializer.data
+
+        log_if_slow("bulk invoice creation", breakdown)
+
+        return Response(data, status=status.HTTP_201_CREATED)
@@ -1,11 +1,26 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, List
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    cast,
+)
+
+from django.db.models import Prefetch, QuerySet
 
 from lxml import etree
 
+from ..instrumentation import timed, timer
+from ..utils import xml_to_bytes
+from .cache import get_sender_fragments
 from .types import ProductSummary, XMLDict
-from .utils import dict_to_xml, format_price
+from .utils import build_xml, format_price, write_xml
+from .validation import validate_xml
 
 if TYPE_CHECKING:
     from invoices.models import Invoice, Sender, Address
@@ -23,6 +38,13 @@ SCHEMA_LOCATION = (
     "/Schema_del_file_xml_FatturaPA_versione_1.2.xsd"
 )
 
+# bump every time the generated XML changes, stored documents rendered by
+# a different version are discarded (see `invoices.models.RenderedInvoice`)
+XML_VERSION = 3
+
+ROOT_TAG = "{%s}FatturaElettronica" % NAMESPACE_MAP["p"]
+SCHEMA_LOCATION_KEY = "{%s}schemaLocation" % NAMESPACE_MAP["xsi"]
+
 
 def _get_recipient_code(invoice: Invoice) -> str:
     if not invoice.recipient_code:
@@ -31,40 +53,22 @@ def _get_recipient_code(invoice: Invoice) -> str:
     return invoice.recipient_code
 
 
+@timed("header")
 def _generate_header(invoice: Invoice) -> XMLDict:
     sender: Sender = invoice.sender
-    address: Address = sender.address
+    sender_fragments = get_sender_fragments(sender)
     client_address: Address = invoice.recipient_address
 
     header: XMLDict = {
         "FatturaElettronicaHeader": {
             "DatiTrasmissione": {
-                "IdTrasmittente": {
-                    "IdPaese": sender.country_code,
-                    "IdCodice": sender.code,
-                },
-                "ProgressivoInvio": 1,
+                "IdTrasmittente": sender_fragments.id_trasmittente,
+                "ProgressivoInvio": invoice.get_progressive(),
                 "FormatoTrasmissione": invoice.transmission_format,
                 "CodiceDestinatario": _get_recipient_code(invoice),
                 "PecDestinatario": invoice.recipient_pec,
             },
-            "CedentePrestatore": {
-                "DatiAnagrafici": {
-                    "IdFiscaleIVA": {
-                        "IdPaese": sender.country_code,
-                        "IdCodice": sender.code,
-                    },
-                    "Anagrafica": {"Denominazione": sender.company_name},
-                    "RegimeFiscale": sender.tax_regime,
-                },
-                "Sede": {
-                    "Indirizzo": address.address,
-                    "CAP": address.postcode,
-                    "Comune": address.city,
-                    "Provincia": address.province,
-                    "Nazione": address.country_code,
-                },
-            },
+            "CedentePrestatore": sender_fragments.cedente_prestatore,
             "CessionarioCommittente": {
                 "DatiAnagrafici": {
                     # TODO: add fiscal code if no recipient_tax_code
@@ -92,8 +96,23 @@ def _generate_header(invoice: Invoice) -> XMLDict:
     return header
 
 
-def _generate_body(invoice: Invoice) -> XMLDict:
-    summary: List[ProductSummary] = invoice.invoice_summary
+def _generate_line(line: ProductSummary) -> XMLDict:
+    return {
+        "NumeroLinea": line.row,
+        "Descrizione": line.description,
+        "Quantita": format_price(line.quantity),
+        "PrezzoUnitario": format_price(line.unit_price),
+        "PrezzoTotale": format_price(line.total_price),
+        "AliquotaIVA": format_price(line.vat_rate),
+    }
+
+
+@timed("body")
+def _generate_body(
+    invoice: Invoice, summary: Optional[Iterable[ProductSummary]] = None
+) -> XMLDict:
+    if summary is None:
+        summary = invoice.invoice_summary
 
     body: XMLDict = {
         "FatturaElettronicaBody": {
@@ -107,24 +126,18 @@ def _generate_body(invoice: Invoice) -> XMLDict:
                 }
             },
             "DatiBeniServizi": {
-                "DettaglioLinee": [
+                # lines are generated lazily, see `invoice_to_xml_stream`
+                "DettaglioLinee": (_generate_line(x) for x in summary),
+                "DatiRiepilogo": [
                     {
-                        "NumeroLinea": x["row"],
-                        "Descrizione": x["description"],
-                        "Quantita": format_price(x["quantity"]),
-                        "PrezzoUnitario": format_price(x["unit_price"]),
-                        "PrezzoTotale": format_price(x["total_price"]),
-                        "AliquotaIVA": format_price(x["vat_rate"]),
+                        "AliquotaIVA": format_price(summary.vat_rate),
+                        "ImponibileImporto": format_price(
+                            summary.taxable_amount
+                        ),
+                        "Imposta": format_price(summary.tax),
                     }
-                    for x in summary
+                    for summary in invoice.vat_summary
                 ],
-                "DatiRiepilogo": {
-                    "AliquotaIVA": format_price(invoice.invoice_tax_rate),
-                    "ImponibileImporto": format_price(invoice.invoice_amount),
-                    "Imposta": format_price(
-                        invoice.invoice_tax_rate * invoice.invoice_amount / 100
-                    ),
-                },
             },
             "DatiPagamento": {
                 "CondizioniPagamento": invoice.payment_condition,
@@ -139,23 +152,157 @@ def _generate_body(invoice: Invoice) -> XMLDict:
     return body
 
 
-def invoice_to_xml(invoice: Invoice) -> etree._Element:
-    root_tag = "{%s}FatturaElettronica" % NAMESPACE_MAP["p"]
-    schema_location_key = "{%s}schemaLocation" % NAMESPACE_MAP["xsi"]
-
-    root = etree.Element(
-        root_tag,
-        attrib={schema_location_key: SCHEMA_LOCATION},
+def _generate_root() -> etree._Element:
+    return etree.Element(
+        ROOT_TAG,
+        attrib={SCHEMA_LOCATION_KEY: SCHEMA_LOCATION},
         nsmap=NAMESPACE_MAP,
         versione="FPR12",
     )
 
+
+def invoice_to_xml(invoice: Invoice, validate: bool = False) -> etree._Element:
+    root = _generate_root()
     header = _generate_header(invoice)
     body = _generate_body(invoice)
 
-    tags = [*dict_to_xml(header), *dict_to_xml(body)]
+    with timer("build_xml"):
+        build_xml(root, header)
+        build_xml(root, body)
 
-    for tag in tags:
-        root.append(tag)
+    if validate:
+        validate_xml(root)
 
     return root
+
+
+def select_for_rendering(invoices: QuerySet) -> QuerySet:
+    """Fetches everything needed to render the invoices of the queryset.
+
+    Senders and addresses are joined and all the items are fetched with
+    a single query, so the number of queries doesn't depend on the number
+    of invoices."""
+
+    from invoices.models import Item
+
+    return invoices.select_related(
+        "sender__address", "recipient_address"
+    ).prefetch_related(
+        Prefetch("items", queryset=Item.objects.order_by("row"))
+    )
+
+
+def fetch_for_rendering(invoices: QuerySet) -> List[Invoice]:
+    """Same as `select_for_rendering`, also fetches the VAT summaries.
+
+    The summaries of all the invoices are computed with one more query,
+    except for the ones storing their `lines`, which are summarized when
+    rendered."""
+
+    from invoices.models import Item
+
+    invoices = list(select_for_rendering(invoices))
+    summaries = Item.objects.vat_summaries(
+        [invoice.pk for invoice in invoices if invoice.lines is None]
+    )
+
+    for invoice in invoices:
+        if invoice.pk in summaries:
+            invoice._vat_summary = summaries[invoice.pk]
+
+    return invoices
+
+
+def invoices_to_xml(
+    invoices: QuerySet, validate: bool = False
+) -> Iterator[Tuple[str, bytes]]:
+    """Renders all the invoices of the queryset, yields (filename, xml)."""
+
+    for invoice in fetch_for_rendering(invoices):
+        xml = invoice_to_xml(invoice, validate=validate)
+
+        yield invoice.get_filename(), xml_to_bytes(xml)
+
+
+def _write_document(
+    fileobj: IO[bytes], header: XMLDict, bodies: Iterable[XMLDict]
+) -> None:
+    # the root is serialized empty (`<p:FatturaElettronica .../>`) and then
+    # split in its opening and closing tags
+    root = cast(bytes, etree.tostring(_generate_root()))
+    root_end = b"</%s>\n" % root[1 : root.index(b" ")]
+
+    fileobj.write(root[:-2] + b">")
+    write_xml(fileobj, header)
+
+    for body in bodies:
+        write_xml(fileobj, body)
+
+    fileobj.write(b"\n" + root_end)
+
+
+def invoice_to_xml_stream(invoice: Invoice, fileobj: IO[bytes]) -> None:
+    """Writes the XML of the invoice to `fileobj` while it is generated.
+
+    Line items are read from the database and written one at a time, so
+    memory usage doesn't grow with the number of lines. The output is the
+    same as `xml_to_string(invoice_to_xml(invoice))`."""
+
+    header = _generate_header(invoice)
+    body = _generate_body(invoice, invoice.iter_summary())
+
+    _write_document(fileobj, header, [body])
+
+
+# fields that must be the same for all the invoices of a lot, since they
+# end up in the shared header
+LOT_FIELDS = (
+    "sender_id",
+    "transmission_format",
+    "recipient_code",
+    "recipient_pec",
+    "recipient_tax_code",
+    "recipient_denomination",
+    "recipient_first_name",
+    "recipient_last_name",
+    "recipient_address_id",
+)
+
+
+def _get_lot_key(invoice: Invoice) -> Tuple:
+    return tuple(getattr(invoice, field) for field in LOT_FIELDS)
+
+
+def invoices_to_lot_xml(
+    invoices: Iterable[Invoice], fileobj: IO[bytes]
+) -> None:
+    """Writes a lot (one header, many bodies) with all the invoices.
+
+    The invoices must share the sender and the recipient, otherwise
+    `ValueError` is raised. The header is built once and the bodies are
+    written to `fileobj` one invoice at a time."""
+
+    if isinstance(invoices, QuerySet):
+        invoices = fetch_for_rendering(invoices)
+
+    iterator = iter(invoices)
+    first = next(iterator, None)
+
+    if first is None:
+        raise ValueError("A lot needs at least one invoice")
+
+    lot_key = _get_lot_key(first)
+
+    def bodies() -> Iterator[XMLDict]:
+        yield _generate_body(first)
+
+        for invoice in iterator:
+            if _get_lot_key(invoice) != lot_key:
+                raise ValueError(
+                    f"Invoice {invoice.invoice_number} has a different "
+                    "sender or recipient"
+                )
+
+            yield _generate_body(invoice)
+
+    _write_document(fileobj, _generate_header(first), bodies())
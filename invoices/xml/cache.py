@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import threading
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Dict, NamedTuple, Tuple
+
+from lxml import etree
+
+from .types import XMLDict
+from .utils import dict_to_xml
+
+if TYPE_CHECKING:
+    from invoices.models import Address, Sender
+
+
+class SenderFragments(NamedTuple):
+    id_trasmittente: etree._Element
+    cedente_prestatore: etree._Element
+
+
+# sender id -> (sender modified timestamp, address id, fragments)
+_sender_fragments: Dict[Any, Tuple[datetime, Any, SenderFragments]] = {}
+_lock = threading.Lock()
+
+
+def _generate_sender_fragments(sender: Sender) -> SenderFragments:
+    address: Address = sender.address
+
+    fragments: XMLDict = {
+        "IdTrasmittente": {
+            "IdPaese": sender.country_code,
+            "IdCodice": sender.code,
+        },
+        "CedentePrestatore": {
+            "DatiAnagrafici": {
+                "IdFiscaleIVA": {
+                    "IdPaese": sender.country_code,
+                    "IdCodice": sender.code,
+                },
+                "Anagrafica": {"Denominazione": sender.company_name},
+                "RegimeFiscale": sender.tax_regime,
+            },
+            "Sede": {
+                "Indirizzo": address.address,
+                "CAP": address.postcode,
+                "Comune": address.city,
+                "Provincia": address.province,
+                "Nazione": address.country_code,
+            },
+        },
+    }
+
+    id_trasmittente, cedente_prestatore = dict_to_xml(fragments)
+
+    return SenderFragments(id_trasmittente, cedente_prestatore)
+
+
+def get_sender_fragments(sender: Sender) -> SenderFragments:
+    """Returns the `IdTrasmittente` and `CedentePrestatore` tags of a sender.
+
+    The tags are built once per sender and reused until the sender (or its
+    address) changes. They are shared, so they must be copied before being
+    added to a document, `dict_to_xml` already takes care of that."""
+
+    cached = _sender_fragments.get(sender.pk)
+
+    if cached is not None and cached[0] == sender.modified:
+        return cached[2]
+
+    fragments = _generate_sender_fragments(sender)
+
+    with _lock:
+        _sender_fragments[sender.pk] = (
+            sender.modified,
+            sender.address_id,
+            fragments,
+        )
+
+    return fragments
+
+
+def invalidate_sender_fragments(sender_id: Any) -> None:
+    with _lock:
+        _sender_fragments.pop(sender_id, None)
+
+
+def invalidate_address_fragments(address_id: Any) -> None:
+    with _lock:
+        for sender_id, (_, cached_address_id, _) in list(
+            _sender_fragments.items()
+        ):
+            if cached_address_id == address_id:
+                del _sender_fragments[sender_id]
+
+
+def clear_sender_fragments() -> None:
+    with _lock:
+        _sender_fragments.clear()
@@ -0,0 +1,274 @@
+"""Imports the FatturaPA files (single invoices and lots) we receive.
+
+The invoices are stored as `ReceivedInvoice`/`ReceivedItem` rows, apart
+from the ones we send. Files are read with `iterparse` and every element
+is dropped as soon as it has been processed, lines are inserted in
+batches, so even files with many bodies and large attachments are imported
+with bounded memory."""
+
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import IO, Any, Dict, List, Optional, Union
+
+from django.db import transaction
+
+from lxml import etree
+
+from ..models import Address, ReceivedInvoice, ReceivedItem, Sender
+
+
+DEFAULT_BATCH_SIZE = 500
+
+TAGS = (
+    "FatturaElettronicaHeader",
+    "DatiGenerali",
+    "DettaglioLinee",
+    "DatiRiepilogo",
+    "DatiPagamento",
+    "Allegati",
+    "FatturaElettronicaBody",
+)
+
+
+class InvoiceImportError(Exception):
+    pass
+
+
+def _text(element: etree._Element, path: str) -> str:
+    value = element.findtext(path)
+
+    return value.strip() if value else ""
+
+
+def _decimal(element: etree._Element, path: str) -> Decimal:
+    value = _text(element, path) or "0"
+
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        number = None
+
+    if number is None or not number.is_finite():
+        raise InvoiceImportError(f"{path} is not a number: {value}")
+
+    return number
+
+
+def _exact_decimal(
+    element: etree._Element, path: str, field: str
+) -> Decimal:
+    """Returns the amount at `path`, for the `field` of `ReceivedItem`.
+
+    Amounts are stored as they are in the file, the ones that could only
+    be stored rounded are rejected."""
+
+    value = _decimal(element, path)
+    model_field = ReceivedItem._meta.get_field(field)
+    _, digits, exponent = value.as_tuple()
+    decimals = max(-int(exponent), 0)
+
+    if (
+        decimals > model_field.decimal_places
+        or len(digits) - decimals
+        > model_field.max_digits - model_field.decimal_places
+    ):
+        raise InvoiceImportError(
+            f"Line {_text(element, 'NumeroLinea')}: {path} {value} can't be "
+            f"stored exactly"
+        )
+
+    return value
+
+
+def _date(element: etree._Element, path: str) -> Optional[date]:
+    value = _text(element, path)
+
+    return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+
+
+def _release(element: etree._Element) -> None:
+    element.clear()
+
+    # also drop the (already processed) elements that come before this one
+    while element.getprevious() is not None:
+        del element.getparent()[0]
+
+
+def _get_recipient(header: etree._Element) -> Sender:
+    recipient = header.find("CessionarioCommittente/DatiAnagrafici")
+    country_code = _text(recipient, "IdFiscaleIVA/IdPaese")
+    code = _text(recipient, "IdFiscaleIVA/IdCodice")
+    fiscal_code = _text(recipient, "CodiceFiscale")
+
+    senders = Sender.objects.all()
+
+    if code:
+        senders = senders.filter(country_code=country_code, code=code)
+    elif fiscal_code:
+        senders = senders.filter(fiscal_code=fiscal_code)
+    else:
+        raise InvoiceImportError("The recipient has no tax code")
+
+    try:
+        return senders.get()
+    except (Sender.DoesNotExist, Sender.MultipleObjectsReturned):
+        raise InvoiceImportError(
+            f"Unknown recipient {country_code}{code or fiscal_code}"
+        )
+
+
+def _parse_header(
+    header: etree._Element, recipient: Optional[Sender]
+) -> Dict[str, Any]:
+    supplier = header.find("CedentePrestatore")
+    names = [
+        _text(supplier, f"DatiAnagrafici/Anagrafica/{tag}")
+        for tag in ("Denominazione", "Nome", "Cognome")
+    ]
+
+    supplier_address, _ = Address.objects.get_or_create_by_fingerprint(
+        address=_text(supplier, "Sede/Indirizzo"),
+        postcode=_text(supplier, "Sede/CAP"),
+        city=_text(supplier, "Sede/Comune"),
+        province=_text(supplier, "Sede/Provincia"),
+        country_code=_text(supplier, "Sede/Nazione"),
+    )
+
+    return {
+        "recipient": recipient or _get_recipient(header),
+        "supplier_country_code": _text(
+            supplier, "DatiAnagrafici/IdFiscaleIVA/IdPaese"
+        ),
+        "supplier_code": _text(
+            supplier, "DatiAnagrafici/IdFiscaleIVA/IdCodice"
+        ),
+        "supplier_denomination": " ".join(filter(None, names)),
+        "supplier_address": supplier_address,
+    }
+
+
+def _create_invoice(
+    header: Dict[str, Any], general_data: etree._Element
+) -> ReceivedInvoice:
+    document = general_data.find("DatiGeneraliDocumento")
+    invoice_date = _date(document, "Data")
+
+    defaults = {
+        "supplier_denomination": header["supplier_denomination"],
+        "supplier_address": header["supplier_address"],
+        "invoice_type": _text(document, "TipoDocumento"),
+        "invoice_currency": _text(document, "Divisa"),
+        # the chunks are split at 200 characters, even in the middle of the
+        # words or before a space
+        "causal": "".join(
+            causal.findtext(".") or ""
+            for causal in document.iterfind("Causale")
+        ).strip(),
+        # the following are read from the rest of the body and updated
+        # when the end of the body is reached
+        "invoice_deadline": None,
+        "invoice_amount": 0,
+        "invoice_tax_amount": 0,
+        "payment_condition": "",
+        "payment_method": "",
+    }
+
+    invoice, created = ReceivedInvoice.objects.update_or_create(
+        recipient=header["recipient"],
+        supplier_country_code=header["supplier_country_code"],
+        supplier_code=header["supplier_code"],
+        invoice_number=_text(document, "Numero"),
+        invoice_date=invoice_date,
+        defaults=defaults,
+    )
+
+    if not created:
+        invoice.items.all().delete()
+
+    return invoice
+
+
+def _parse_line(
+    invoice: ReceivedInvoice, line: etree._Element
+) -> ReceivedItem:
+    return ReceivedItem(
+        invoice=invoice,
+        row=int(_text(line, "NumeroLinea")),
+        description=_text(line, "Descrizione"),
+        quantity=(
+            _exact_decimal(line, "Quantita", "quantity")
+            if _text(line, "Quantita")
+            else None
+        ),
+        unit_price=_exact_decimal(line, "PrezzoUnitario", "unit_price"),
+        total_price=_exact_decimal(line, "PrezzoTotale", "total_price"),
+        vat_rate=_decimal(line, "AliquotaIVA"),
+    )
+
+
+def import_invoices(
+    source: Union[str, IO[bytes]],
+    recipient: Optional[Sender] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> List[int]:
+    """Imports all the invoices of a FatturaPA file, returns their ids.
+
+    The invoices are received by `recipient`, by default the sender with
+    the VAT number (or fiscal code) of the `CessionarioCommittente` of the
+    file. Invoices imported again (same supplier, number and date) are
+    updated."""
+
+    header: Dict[str, Any] = {}
+    invoice: ReceivedInvoice
+    items: List[ReceivedItem] = []
+    ids: List[int] = []
+
+    events = etree.iterparse(
+        source,
+        events=("end",),
+        tag=TAGS,
+        huge_tree=True,
+        no_network=True,
+        resolve_entities=False,
+    )
+
+    with transaction.atomic():
+        for _, element in events:
+            tag = element.tag
+
+            if tag == "FatturaElettronicaHeader":
+                header = _parse_header(element, recipient)
+            elif tag == "DatiGenerali":
+                invoice = _create_invoice(header, element)
+            elif tag == "DettaglioLinee":
+                items.append(_parse_line(invoice, element))
+
+                if len(items) >= batch_size:
+                    ReceivedItem.objects.bulk_create(items)
+                    items = []
+            elif tag == "DatiRiepilogo":
+                invoice.invoice_amount += _decimal(
+                    element, "ImponibileImporto"
+                )
+                invoice.invoice_tax_amount += _decimal(element, "Imposta")
+            elif tag == "DatiPagamento":
+                invoice.payment_condition = _text(
+                    element, "CondizioniPagamento"
+                )
+                invoice.payment_method = _text(
+                    element, "DettaglioPagamento/ModalitaPagamento"
+                )
+                invoice.invoice_deadline = _date(
+                    element, "DettaglioPagamento/DataScadenzaPagamento"
+                )
+            elif tag == "FatturaElettronicaBody":
+                ReceivedItem.objects.bulk_create(items)
+                items = []
+
+                invoice.save()
+                ids.append(invoice.pk)
+
+            # attachments are skipped, they are only released
+            _release(element)
+
+    return ids
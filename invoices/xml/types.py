@@ -1,19 +1,66 @@
-from typing import Any, Dict, List, Union
-
-from mypy_extensions import TypedDict
-
-
-ProductSummary = TypedDict(
-    "ProductSummary",
-    {
-        "row": int,
-        "description": str,
-        "quantity": float,
-        "unit_price": float,
-        "total_price": float,
-        "vat_rate": float,
-    },
-)
+from decimal import Decimal
+from typing import Any, Dict, List, NamedTuple, Union
+
+
+CENTS = Decimal("0.01")
+
+
+class ProductSummary:
+    """A line of an invoice, as rendered in the XML."""
+
+    # invoices can have many thousands of lines, keep them small
+    __slots__ = ("row", "description", "quantity", "unit_price", "vat_rate")
+
+    def __init__(
+        self,
+        row: int,
+        description: str,
+        quantity: int,
+        unit_price: Decimal,
+        vat_rate: Decimal,
+    ) -> None:
+        self.row = row
+        self.description = description
+        self.quantity = quantity
+        self.unit_price = unit_price
+        self.vat_rate = vat_rate
+
+    @property
+    def total_price(self) -> Decimal:
+        return self.unit_price * self.quantity
+
+    def to_json(self) -> Dict[str, Any]:
+        """Returns the line as stored in `Invoice.lines`."""
+
+        # floats keep the values exact: prices have at most 8 digits and
+        # `str(float)` is the shortest string converting to the same float
+        return {
+            "row": self.row,
+            "description": self.description,
+            "quantity": self.quantity,
+            "unit_price": float(self.unit_price),
+            "total_price": float(self.total_price),
+            "vat_rate": float(self.vat_rate),
+        }
+
+    @classmethod
+    def from_json(cls, line: Dict[str, Any]) -> "ProductSummary":
+        return cls(
+            line["row"],
+            line["description"],
+            line["quantity"],
+            Decimal(str(line["unit_price"])).quantize(CENTS),
+            Decimal(str(line["vat_rate"])).quantize(CENTS),
+        )
+
+
+class VatSummary(NamedTuple):
+    """Total of the lines of an invoice with the same VAT rate."""
+
+    vat_rate: Decimal
+    taxable_amount: Decimal
+    tax: Decimal
+
 
 # nested recursive types are not supported in MYPY
 XMLDict = Dict[str, Union[str, int, List[Any], Any]]
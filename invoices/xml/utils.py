@@ -1,58 +1,168 @@
+from copy import deepcopy
 from decimal import Decimal
-from typing import Dict, List
+from functools import lru_cache
+from typing import IO, Any, Iterator, List, cast
 
 import unidecode
 from lxml import etree
 
+from ..instrumentation import timed
 from .types import XMLDict
 
 
-def _split_tags(tag_name: str, text: bytes) -> List[etree._Element]:
-    tags: List[etree._Element] = []
+TRANSLITERATION_CACHE_SIZE = 4096
 
+
+# only the cache misses are timed, hits are too cheap to measure
+@timed("transliterate")
+def _transliterate(value: str) -> bytes:
+    return unidecode.unidecode(value).encode("latin_1")
+
+
+_transliterate_cached = lru_cache(maxsize=TRANSLITERATION_CACHE_SIZE)(
+    _transliterate
+)
+
+
+def transliterate(value: str) -> bytes:
+    """Converts the value to the latin_1 encoded ASCII used in the XML.
+
+    Most values (codes, dates, prices) are already ASCII and are only
+    encoded, the others go through unidecode and are memoized, as the same
+    names and descriptions repeat across invoices."""
+
+    if value.isascii():
+        return value.encode("latin_1")
+
+    return _transliterate_cached(value)
+
+
+def transliteration_cache_info():
+    """Hits and misses of the cache of the non ASCII values."""
+
+    return _transliterate_cached.cache_info()
+
+
+def configure_transliteration_cache(maxsize: int) -> None:
+    global _transliterate_cached
+
+    _transliterate_cached = lru_cache(maxsize=maxsize)(_transliterate)
+
+
+def _split_tags(parent: etree._Element, tag_name: str, text: bytes) -> None:
     size = 200
 
-    chunks = [text[y - size : y] for y in range(size, len(text) + size, size)]
+    for start in range(0, len(text), size):
+        etree.SubElement(parent, tag_name).text = text[start : start + size]
 
-    for value in chunks:
-        tag = etree.Element(tag_name)
-        tag.text = value
-        tags.append(tag)
 
-    return tags
+def build_xml(parent: etree._Element, data: XMLDict) -> None:
+    """Creates the tags described by `data` as children of `parent`.
+
+    The dict is walked once in order, which is the order required by the
+    FatturaPA schema, and every tag is created in place."""
 
+    for key, value in data.items():
+        # prebuilt tags (see `invoices.xml.cache`) are shared, copy them
 
-def dict_to_xml(dict: XMLDict):
-    tags: List[etree._Element] = []
+        if isinstance(value, etree._Element):
+            parent.append(deepcopy(value))
+            continue
 
-    for key, value in dict.items():
         # skip empty value
 
         if not value:
             continue
 
-        if isinstance(value, (Dict, List)):
-            if not isinstance(value, List):
-                value = [value]
-
+        if isinstance(value, dict):
+            build_xml(etree.SubElement(parent, key), value)
+        elif isinstance(value, (list, Iterator)):
             for item in value:
-                tag = etree.Element(key)
-
-                for subtag in dict_to_xml(item):
-                    tag.append(subtag)
-
-                tags.append(tag)
+                build_xml(etree.SubElement(parent, key), item)
         else:
             if isinstance(value, (int, float, Decimal)):
                 value = str(value)
 
-            value = unidecode.unidecode(value).encode("latin_1")
+            _split_tags(parent, key, transliterate(value))
+
+
+def dict_to_xml(dict: XMLDict) -> List[etree._Element]:
+    container = etree.Element("container")
+
+    build_xml(container, dict)
 
-            for tag in _split_tags(key, value):
-                tags.append(tag)
+    tags = list(container)
+
+    # detach the tags from the container
+    container.clear()
 
     return tags
 
 
+def _has_iterator(value: Any) -> bool:
+    if isinstance(value, Iterator):
+        return True
+
+    if isinstance(value, dict):
+        return any(_has_iterator(item) for item in value.values())
+
+    return False
+
+
+def indent(tag: etree._Element, level: int = 0) -> None:
+    """Indents `tag` in place, like `etree.indent` of lxml 4.5+ does.
+
+    The whitespace is only added where there is no text already, `level`
+    is the indentation level of `tag` itself."""
+
+    children = list(tag)
+
+    if not children:
+        return
+
+    child_indent = "\n" + "  " * (level + 1)
+
+    if not tag.text or not tag.text.strip():
+        tag.text = child_indent
+
+    for child in children:
+        indent(child, level + 1)
+
+        if not child.tail or not child.tail.strip():
+            child.tail = child_indent
+
+    if not children[-1].tail.strip():
+        children[-1].tail = "\n" + "  " * level
+
+
+def _indented_tostring(tag: etree._Element, level: int) -> bytes:
+    indent(tag, level=level)
+
+    return cast(bytes, etree.tostring(tag))
+
+
+def write_xml(fileobj: IO[bytes], data: XMLDict, level: int = 1) -> None:
+    """Incremental counterpart of `dict_to_xml`, writes the tags to `fileobj`.
+
+    Iterators are consumed one item at a time and every item is written
+    as soon as it is built, so they are never kept in memory; the output
+    matches `etree.tostring(..., pretty_print=True)` of the same dict."""
+
+    prefix = b"\n" + b"  " * level
+
+    for key, value in data.items():
+        if isinstance(value, Iterator):
+            for item in value:
+                for tag in dict_to_xml({key: [item]}):
+                    fileobj.write(prefix + _indented_tostring(tag, level))
+        elif isinstance(value, dict) and _has_iterator(value):
+            fileobj.write(b"%s<%s>" % (prefix, key.encode()))
+            write_xml(fileobj, value, level + 1)
+            fileobj.write(b"%s</%s>" % (prefix, key.encode()))
+        else:
+            for tag in dict_to_xml({key: value}):
+                fileobj.write(prefix + _indented_tostring(tag, level))
+
+
 def format_price(value):
     return "{:.2f}".format(value)
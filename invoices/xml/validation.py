@@ -0,0 +1,61 @@
+import os
+import threading
+from typing import Optional, Union
+
+from lxml import etree
+
+from ..instrumentation import timed
+
+
+SCHEMAS_DIR = os.path.join(os.path.dirname(__file__), "schemas")
+
+FATTURAPA_SCHEMA = os.path.join(
+    SCHEMAS_DIR, "Schema_del_file_xml_FatturaPA_versione_1.2.2.xsd"
+)
+XMLDSIG_SCHEMA = os.path.join(SCHEMAS_DIR, "xmldsig-core-schema.xsd")
+
+# location of the xmldsig schema as imported by the FatturaPA schema
+XMLDSIG_SCHEMA_LOCATION = (
+    "http://www.w3.org/TR/2002/REC-xmldsig-core-20020212"
+    "/xmldsig-core-schema.xsd"
+)
+
+
+class _BundledSchemasResolver(etree.Resolver):
+    def resolve(self, url, id, context):
+        if url == XMLDSIG_SCHEMA_LOCATION:
+            return self.resolve_filename(XMLDSIG_SCHEMA, context)
+
+        return None
+
+
+_schema: Optional[etree.XMLSchema] = None
+_schema_lock = threading.Lock()
+
+
+def get_schema() -> etree.XMLSchema:
+    """Returns the compiled FatturaPA schema.
+
+    The schema is compiled from the bundled XSDs the first time it is
+    needed and then shared by the whole process."""
+
+    global _schema
+
+    if _schema is None:
+        with _schema_lock:
+            if _schema is None:
+                parser = etree.XMLParser(no_network=True)
+                parser.resolvers.add(_BundledSchemasResolver())
+
+                _schema = etree.XMLSchema(
+                    etree.parse(FATTURAPA_SCHEMA, parser=parser)
+                )
+
+    return _schema
+
+
+@timed("validate")
+def validate_xml(xml: Union[etree._Element, etree._ElementTree]) -> None:
+    """Raises `etree.DocumentInvalid` if `xml` doesn't respect the schema."""
+
+    get_schema().assertValid(xml)
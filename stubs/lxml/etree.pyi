@@ -32,8 +32,15 @@ class _Element(Iterable['_Element']):
     # http://lxml.de/xpathxslt.html#xpath-return-values
     attrib = ...  # type: MutableMapping[str, str]
     text = ...  # type: _AnyStr
+    tail = ...  # type: _AnyStr
     tag = ...  # type: str
     def append(self, element: '_Element') -> '_Element': ...
+    def find(self, path: _AnyStr) -> '_Element': ...
+    def findtext(self, path: _AnyStr, default: Optional[str] = ...) -> Optional[str]: ...
+    def iterfind(self, path: _AnyStr) -> Iterator['_Element']: ...
+    def getparent(self) -> '_Element': ...
+    def getprevious(self) -> Optional['_Element']: ...
+    def __delitem__(self, index: Union[int, slice]) -> None: ...
     def __iter__(self) -> ElementChildIterator: ...
 
 class ElementBase(_Element): ...
@@ -57,7 +64,15 @@ class _XSLTResultTree(SupportsBytes, metaclass=abc.ABCMeta): ...
 
 class _XSLTQuotedStringParam: ...
 
-class XMLParser: ...
+class Resolver:
+    def resolve_filename(self, filename: _AnyStr, context: Any) -> Any: ...
+
+class _ResolverRegistry:
+    def add(self, resolver: Resolver) -> None: ...
+
+class XMLParser:
+    def __init__(self, **kwargs: Any) -> None: ...
+    resolvers = ...  # type: _ResolverRegistry
 
 class XMLSchema:
     def __init__(self,
@@ -110,6 +125,10 @@ def tostring(element_or_tree: Union[_Element, _ElementTree],
              exclusive: bool = ...,
              with_comments: bool = ...,
              inclusive_ns_prefixes: Any = ...) -> _AnyStr: ...
+def iterparse(source: Union[_AnyStr, typing.IO],
+              events: Tuple[str, ...] = ...,
+              tag: Union[_AnyStr, Tuple[_AnyStr, ...]] = ...,
+              **kwargs: Any) -> Iterator[Tuple[str, _Element]]: ...
 
 class _ErrorLog: ...
 
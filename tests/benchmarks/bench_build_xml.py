@@ -0,0 +1,135 @@
+"""Compares `build_xml` with the recursive `dict_to_xml` it replaced.
+
+Run with `python -m tests.benchmarks.bench_build_xml [lines]`."""
+
+import sys
+import timeit
+import tracemalloc
+from decimal import Decimal
+from typing import Dict, List
+
+import unidecode
+from lxml import etree
+
+from invoices.xml import _generate_line
+from invoices.xml.types import ProductSummary, XMLDict
+from invoices.xml.utils import build_xml
+
+
+def legacy_dict_to_xml(dict: XMLDict):
+    tags: List[etree._Element] = []
+
+    for key, value in dict.items():
+        if not value:
+            continue
+
+        if isinstance(value, (Dict, List)):
+            if not isinstance(value, List):
+                value = [value]
+
+            for item in value:
+                tag = etree.Element(key)
+
+                for subtag in legacy_dict_to_xml(item):
+                    tag.append(subtag)
+
+                tags.append(tag)
+        else:
+            if isinstance(value, (int, float, Decimal)):
+                value = str(value)
+
+            value = unidecode.unidecode(value).encode("latin_1")
+
+            size = 200
+            for start in range(0, len(value), size):
+                tag = etree.Element(key)
+                tag.text = value[start : start + size]
+                tags.append(tag)
+
+    return tags
+
+
+def legacy(data: XMLDict) -> etree._Element:
+    root = etree.Element("root")
+
+    for tag in legacy_dict_to_xml(data):
+        root.append(tag)
+
+    return root
+
+
+def builder(data: XMLDict) -> etree._Element:
+    root = etree.Element("root")
+
+    build_xml(root, data)
+
+    return root
+
+
+def sample_body(lines: int) -> XMLDict:
+    return {
+        "FatturaElettronicaBody": {
+            "DatiGenerali": {
+                "DatiGeneraliDocumento": {
+                    "TipoDocumento": "TD01",
+                    "Divisa": "EUR",
+                    "Data": "2019-06-16",
+                    "Numero": "00001A",
+                    "Causale": "Causale è lunga " * 40,
+                }
+            },
+            "DatiBeniServizi": {
+                "DettaglioLinee": [
+                    _generate_line(
+                        ProductSummary(
+                            row,
+                            f"Biglietto PyCon {row}",
+                            1,
+                            Decimal("100.00"),
+                            Decimal("22.00"),
+                        )
+                    )
+                    for row in range(1, lines + 1)
+                ],
+                "DatiRiepilogo": {
+                    "AliquotaIVA": "22.00",
+                    "ImponibileImporto": f"{lines * 100}.00",
+                    "Imposta": f"{lines * 22}.00",
+                },
+            },
+        }
+    }
+
+
+def peak_memory(function, data: XMLDict) -> int:
+    """Peak of the memory allocated by python while running `function`.
+
+    It accounts for the temporary lists and element proxies, the nodes
+    themselves are allocated by libxml2 and are not traced."""
+
+    tracemalloc.start()
+    function(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return peak
+
+
+def main(lines: int = 1000, repeat: int = 20) -> None:
+    data = sample_body(lines)
+
+    assert etree.tostring(legacy(data)) == etree.tostring(builder(data))
+
+    for name, function in (("dict_to_xml", legacy), ("build_xml", builder)):
+        seconds = min(
+            timeit.repeat(lambda: function(data), number=1, repeat=repeat)
+        )
+        print(
+            f"{name:>12}: {seconds * 1000:8.2f} ms, "
+            f"peak {peak_memory(function, data) / 1024:8.1f} KiB "
+            f"({lines} lines)"
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
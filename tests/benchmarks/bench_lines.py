@@ -0,0 +1,164 @@
+"""Write and read latency of the lines stored as `Item` rows or as JSON.
+
+Run with `python -m tests.benchmarks.bench_lines`, options:
+
+    --sizes 100 10000   number of lines of the invoice
+
+Writing replaces the lines of an invoice like a re-upload does, reading
+fetches the invoice and builds its `invoice_summary`. The invoices are
+created in a test database (`test_` + the name of the configured
+database), which is destroyed at the end. Use the same database engine as
+production (PostgreSQL), SQLite doesn't store JSON as JSONB."""
+
+import argparse
+import os
+from datetime import date
+from decimal import Decimal
+from functools import partial
+from typing import List, Sequence
+
+import django
+
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fatturae.settings")
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+
+from invoices.models import Address, Invoice, Item, Sender  # noqa: E402
+from invoices.xml.types import ProductSummary  # noqa: E402
+
+from .factory import ASCII_TEXT  # noqa: E402
+from .runner import Case, run  # noqa: E402
+
+
+SIZES = (100, 10_000)
+
+# lines written by every case, the repetitions decrease with the size
+LINES_PER_CASE = 100_000
+
+
+def _repeat(size: int) -> int:
+    return max(3, min(50, LINES_PER_CASE // size))
+
+
+def _make_lines(size: int) -> List[ProductSummary]:
+    return [
+        ProductSummary(
+            row,
+            f"{ASCII_TEXT} {row}",
+            row % 10 + 1,
+            Decimal("12.50"),
+            Decimal("22.00"),
+        )
+        for row in range(1, size + 1)
+    ]
+
+
+def _write_items(invoice: Invoice, lines: List[ProductSummary]) -> None:
+    # what `InvoiceSerializer.create` does
+    with transaction.atomic():
+        invoice.items.all().delete()
+
+        for line in lines:
+            Item.objects.create(
+                row=line.row,
+                invoice=invoice,
+                description=line.description,
+                quantity=line.quantity,
+                unit_price=line.unit_price,
+                vat_rate=line.vat_rate,
+            )
+
+
+def _write_lines(invoice: Invoice, lines: List[ProductSummary]) -> None:
+    with transaction.atomic():
+        invoice.lines = [line.to_json() for line in lines]
+        invoice.save()
+
+
+def _read(invoice_id: int) -> None:
+    Invoice.objects.get(pk=invoice_id).invoice_summary
+
+
+def _make_invoice(number: str, sender: Sender, address: Address) -> Invoice:
+    return Invoice.objects.create(
+        sender=sender,
+        invoice_number=number,
+        invoice_type="TD01",
+        invoice_currency="EUR",
+        invoice_date=date(2019, 6, 16),
+        invoice_deadline=date(2019, 7, 16),
+        invoice_tax_rate=22,
+        invoice_amount=100,
+        invoice_tax_amount=22,
+        transmission_format="FPR12",
+        payment_condition="TP02",
+        payment_method="MP08",
+        recipient_address=address,
+    )
+
+
+def main(sizes: Sequence[int]) -> None:
+    name = connection.creation.create_test_db(verbosity=0)
+
+    try:
+        address = Address.objects.create(
+            address="Via Roma 1", city="Avellino", postcode="83100"
+        )
+        sender = Sender.objects.create(
+            name="Sender",
+            code="S000001",
+            country_code="IT",
+            company_name="Sender",
+            tax_regime="RF01",
+            address=address,
+            user=get_user_model().objects.create(username="user"),
+        )
+
+        for size in sizes:
+            lines = _make_lines(size)
+            repeat = _repeat(size)
+
+            with_items = _make_invoice(f"items-{size}", sender, address)
+            with_lines = _make_invoice(f"lines-{size}", sender, address)
+
+            run(
+                [
+                    Case(
+                        f"write[{size},items]",
+                        partial(_write_items, with_items, lines),
+                        size,
+                        repeat,
+                    ),
+                    Case(
+                        f"write[{size},lines]",
+                        partial(_write_lines, with_lines, lines),
+                        size,
+                        repeat,
+                    ),
+                    Case(
+                        f"read[{size},items]",
+                        partial(_read, with_items.pk),
+                        size,
+                        repeat,
+                    ),
+                    Case(
+                        f"read[{size},lines]",
+                        partial(_read, with_lines.pk),
+                        size,
+                        repeat,
+                    ),
+                ]
+            )
+    finally:
+        connection.creation.destroy_test_db(name, verbosity=0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    options = parser.parse_args()
+
+    main(options.sizes)
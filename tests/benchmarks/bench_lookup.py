@@ -0,0 +1,164 @@
+"""Latency of the invoice lookups as the invoices table grows.
+
+Run with `python -m tests.benchmarks.bench_lookup`, options:
+
+    --sizes 10000 100000 1000000   number of invoices to measure at
+    --without-indexes              also measure without the lookup indexes
+
+The invoices are created in a test database (`test_` + the name of the
+configured database), which is destroyed at the end. Use the same database
+engine as production (PostgreSQL), SQLite query plans are not comparable."""
+
+import argparse
+import os
+import random
+from datetime import date, timedelta
+from functools import partial
+from typing import List, Sequence
+
+import django
+
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fatturae.settings")
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection  # noqa: E402
+
+from invoices.models import Address, Invoice, Sender  # noqa: E402
+
+from .runner import Case, run  # noqa: E402
+
+
+SIZES = (10_000, 100_000, 1_000_000)
+SENDERS = 10
+BATCH_SIZE = 10_000
+REPEAT = 200
+
+FIRST_DATE = date(2019, 1, 1)
+
+
+def _create_invoices(start: int, end: int, senders: List, address) -> None:
+    for batch in range(start, end, BATCH_SIZE):
+        Invoice.objects.bulk_create(
+            Invoice(
+                sender=senders[number % SENDERS],
+                invoice_number=f"{number:08}",
+                invoice_type="TD01",
+                invoice_currency="EUR",
+                invoice_date=FIRST_DATE + timedelta(days=number % 3650),
+                invoice_deadline=FIRST_DATE,
+                invoice_tax_rate=22,
+                invoice_amount=100,
+                invoice_tax_amount=22,
+                transmission_format="FPR12",
+                payment_condition="TP02",
+                payment_method="MP08",
+                recipient_address=address,
+            )
+            for number in range(batch, min(batch + BATCH_SIZE, end))
+        )
+
+
+def _lookup_by_number(senders: List, size: int) -> None:
+    number = random.randrange(size)
+
+    Invoice.objects.get(
+        sender=senders[number % SENDERS], invoice_number=f"{number:08}"
+    )
+
+
+def _lookup_by_date(senders: List) -> None:
+    start = FIRST_DATE + timedelta(days=random.randrange(3650))
+
+    list(
+        Invoice.objects.filter(
+            sender=random.choice(senders),
+            invoice_date__range=(start, start + timedelta(days=7)),
+        ).values_list("pk", flat=True)
+    )
+
+
+def _set_indexes(enabled: bool) -> None:
+    meta = Invoice._meta
+    unique_together = set(meta.unique_together)
+
+    with connection.schema_editor() as editor:
+        for index in meta.indexes:
+            if enabled:
+                editor.add_index(Invoice, index)
+            else:
+                editor.remove_index(Invoice, index)
+
+        editor.alter_unique_together(
+            Invoice,
+            set() if enabled else unique_together,
+            unique_together if enabled else set(),
+        )
+
+
+def _measure(label: str, senders: List, size: int) -> None:
+    run(
+        [
+            Case(
+                f"by_number[{size},{label}]",
+                partial(_lookup_by_number, senders, size),
+                1,
+                REPEAT,
+            ),
+            Case(
+                f"by_date[{size},{label}]",
+                partial(_lookup_by_date, senders),
+                1,
+                REPEAT,
+            ),
+        ]
+    )
+
+
+def main(sizes: Sequence[int], without_indexes: bool) -> None:
+    name = connection.creation.create_test_db(verbosity=0)
+
+    try:
+        address = Address.objects.create(
+            address="Via Roma 1", city="Avellino", postcode="83100"
+        )
+        senders = [
+            Sender.objects.create(
+                name=f"Sender {number}",
+                code=f"S{number:06}",
+                country_code="IT",
+                company_name=f"Sender {number}",
+                tax_regime="RF01",
+                address=address,
+                user=get_user_model().objects.create(username=f"user{number}"),
+            )
+            for number in range(SENDERS)
+        ]
+
+        created = 0
+
+        for size in sorted(sizes):
+            _create_invoices(created, size, senders, address)
+            created = size
+
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+            _measure("indexed", senders, size)
+
+            if without_indexes:
+                _set_indexes(False)
+                _measure("no indexes", senders, size)
+                _set_indexes(True)
+    finally:
+        connection.creation.destroy_test_db(name, verbosity=0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--without-indexes", action="store_true")
+    options = parser.parse_args()
+
+    main(options.sizes, options.without_indexes)
@@ -0,0 +1,136 @@
+"""Benchmarks of the XML rendering, on invoices with 1 to 100k lines.
+
+Run with `python -m tests.benchmarks.bench_rendering`, options:
+
+    --sizes 1 100      number of lines of the invoices
+    --save FILE        store the results (e.g. as a new baseline)
+    --compare [FILE]   compare with a baseline (`baseline.json` by default),
+                       exits with 1 if any case regressed
+    --tolerance 0.25   allowed slowdown (or memory increase) as a fraction
+
+The baseline depends on the machine it was recorded on, record a new one
+(with `--save`) before comparing on a different machine."""
+
+import argparse
+import os
+import sys
+from functools import partial
+from typing import List, Sequence
+
+import django
+
+from invoices.utils import xml_to_string
+from invoices.xml import _generate_body, invoice_to_xml
+from invoices.xml.utils import _split_tags, dict_to_xml, transliterate
+from lxml import etree
+
+from .runner import Case, compare, load, run, save
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+SIZES = (1, 100, 10_000, 100_000)
+CAUSAL_LENGTHS = (200, 20_000)
+
+# lines rendered by every case, the repetitions decrease with the size
+LINES_PER_CASE = 100_000
+
+
+def _repeat(size: int) -> int:
+    return max(3, min(100, LINES_PER_CASE // size))
+
+
+def _render_body(invoice) -> List[etree._Element]:
+    return dict_to_xml(_generate_body(invoice))
+
+
+def _split_causal(text: bytes) -> None:
+    _split_tags(etree.Element("DatiGeneraliDocumento"), "Causale", text)
+
+
+def get_cases(
+    sizes: Sequence[int] = SIZES,
+    causal_lengths: Sequence[int] = CAUSAL_LENGTHS,
+) -> List[Case]:
+    # the factory uses the models, which can't be imported before setup
+    from .factory import make_invoice, make_long_text
+
+    cases = []
+
+    for accented in (False, True):
+        variant = "accented" if accented else "ascii"
+
+        for size in sizes:
+            invoice = make_invoice(size, accented=accented)
+            xml = invoice_to_xml(invoice)
+            repeat = _repeat(size)
+
+            cases += [
+                Case(
+                    f"invoice_to_xml[{size},{variant}]",
+                    partial(invoice_to_xml, invoice),
+                    size,
+                    repeat,
+                ),
+                Case(
+                    f"dict_to_xml[{size},{variant}]",
+                    partial(_render_body, invoice),
+                    size,
+                    repeat,
+                ),
+                Case(
+                    f"xml_to_string[{size},{variant}]",
+                    partial(xml_to_string, xml),
+                    size,
+                    repeat,
+                ),
+            ]
+
+        for length in causal_lengths:
+            text = transliterate(make_long_text(length, accented))
+
+            cases.append(
+                Case(
+                    f"_split_tags[{length},{variant}]",
+                    partial(_split_causal, text),
+                    length,
+                    100,
+                )
+            )
+
+    return cases
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--save")
+    parser.add_argument("--compare", nargs="?", const=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    options = parser.parse_args(argv)
+
+    results = run(get_cases(options.sizes))
+
+    if options.save:
+        save(results, options.save)
+
+    if options.compare:
+        regressions = compare(
+            results, load(options.compare), options.tolerance
+        )
+
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fatturae.settings")
+    # the invoices are built in memory, the database is never used
+    os.environ.setdefault("DATABASE_URL", "sqlite://:memory:")
+    django.setup()
+
+    sys.exit(main())
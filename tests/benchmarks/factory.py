@@ -0,0 +1,103 @@
+"""Synthetic invoices for the benchmarks.
+
+The invoices are built in memory, with the lines stored as if they were
+fetched with `prefetch_related`, so rendering them doesn't need a database."""
+
+from datetime import date
+from decimal import Decimal
+
+from invoices.models import Address, Invoice, Item, Sender
+from invoices.xml.types import VatSummary
+
+
+ASCII_TEXT = "Biglietto PyCon Italia, accesso a tutte le giornate"
+ACCENTED_TEXT = "Però è già più caro: Łukasz ha pagato città e caffè"
+
+# a FatturaPA `Causale` is split in 200 chars tags
+LONG_CAUSAL_LENGTH = 2000
+
+
+def _text(accented: bool) -> str:
+    return ACCENTED_TEXT if accented else ASCII_TEXT
+
+
+def make_long_text(length: int, accented: bool = False) -> str:
+    text = _text(accented)
+
+    return (text * (length // len(text) + 1))[:length]
+
+
+def make_invoice(
+    lines: int,
+    accented: bool = False,
+    causal_length: int = LONG_CAUSAL_LENGTH,
+) -> Invoice:
+    text = _text(accented)
+
+    address = Address(
+        pk=1,
+        address="Via Mugellese 1/A",
+        city="Campi Bisenzio",
+        postcode="50013",
+        province="FI",
+        country_code="IT",
+    )
+    sender = Sender(
+        pk=1,
+        name="Python Italia APS",
+        code="PIABCDE",
+        country_code="IT",
+        company_name="Python Italia APS",
+        tax_regime="RF01",
+        address=address,
+    )
+    invoice = Invoice(
+        pk=1,
+        sender=sender,
+        invoice_number="00001A",
+        progressive=1,
+        invoice_type="TD01",
+        invoice_currency="EUR",
+        invoice_date=date(2019, 6, 16),
+        invoice_deadline=date(2019, 7, 16),
+        invoice_tax_rate=Decimal("22.00"),
+        invoice_amount=Decimal(lines) * Decimal("12.50"),
+        invoice_tax_amount=Decimal(lines) * Decimal("2.75"),
+        causal=make_long_text(causal_length, accented),
+        transmission_format="FPR12",
+        payment_condition="TP02",
+        payment_method="MP08",
+        recipient_code="ABCDEFG",
+        recipient_tax_code="AAABBB12B34Z123D",
+        recipient_first_name="Łukasz" if accented else "Patrick",
+        recipient_last_name="Rossi",
+        recipient_address=address,
+    )
+
+    items = Item.objects.all()
+    # what `prefetch_related` does with the fetched items
+    items._result_cache = [
+        Item(
+            pk=row,
+            invoice=invoice,
+            row=row,
+            description=f"{text} {row}",
+            quantity=row % 10 + 1,
+            unit_price=Decimal("12.50"),
+            vat_rate=Decimal("22.00"),
+        )
+        for row in range(1, lines + 1)
+    ]
+    items._prefetch_done = True
+
+    invoice._prefetched_objects_cache = {"items": items}
+    # what `fetch_for_rendering` does, all the lines have the same rate
+    invoice._vat_summary = [
+        VatSummary(
+            Decimal("22.00"),
+            invoice.invoice_amount,
+            invoice.invoice_amount * Decimal("0.22"),
+        )
+    ]
+
+    return invoice
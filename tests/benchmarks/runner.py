@@ -0,0 +1,127 @@
+"""Measures benchmark cases and compares them with a baseline."""
+
+import gc
+import json
+import math
+import time
+import tracemalloc
+from typing import Callable, Dict, List, NamedTuple
+
+
+class Case(NamedTuple):
+    name: str
+    function: Callable[[], object]
+    # how many items (lines, chars...) a run processes
+    size: int
+    repeat: int
+
+
+Result = Dict[str, float]
+
+
+def percentile(timings: List[float], percent: float) -> float:
+    """Nearest-rank percentile of `timings`."""
+
+    ordered = sorted(timings)
+    rank = math.ceil(percent / 100 * len(ordered))
+
+    return ordered[max(rank, 1) - 1]
+
+
+def _peak_memory(function: Callable[[], object]) -> int:
+    """Peak of the memory allocated by python while running `function`.
+
+    The XML nodes are allocated by libxml2 and are not traced, only the
+    python objects (dicts, strings, element proxies) are."""
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak
+
+
+def run_case(case: Case) -> Result:
+    timings = []
+
+    # like timeit, the garbage collector doesn't run during the timings
+    gc.collect()
+    gc.disable()
+
+    try:
+        for _ in range(case.repeat):
+            start = time.perf_counter()
+            case.function()
+            timings.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+
+    # memory is traced in a separate run, tracing slows down python a lot
+    peak = _peak_memory(case.function)
+
+    return {
+        "throughput": case.size / (sum(timings) / len(timings)),
+        "p50_ms": percentile(timings, 50) * 1000,
+        "p99_ms": percentile(timings, 99) * 1000,
+        "peak_kib": peak / 1024,
+    }
+
+
+def run(cases: List[Case], verbose: bool = True) -> Dict[str, Result]:
+    results = {}
+
+    for case in cases:
+        result = results[case.name] = run_case(case)
+
+        if verbose:
+            print(
+                f"{case.name:<40} {result['throughput']:>12.0f}/s "
+                f"p50 {result['p50_ms']:>10.2f} ms "
+                f"p99 {result['p99_ms']:>10.2f} ms "
+                f"peak {result['peak_kib']:>10.1f} KiB"
+            )
+
+    return results
+
+
+def save(results: Dict[str, Result], path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load(path: str) -> Dict[str, Result]:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(
+    results: Dict[str, Result],
+    baseline: Dict[str, Result],
+    tolerance: float = 0.25,
+) -> List[str]:
+    """Returns the regressions of `results` compared to `baseline`.
+
+    A case regressed if its median latency or its peak memory grew more
+    than `tolerance` (a fraction). Cases missing on either side are
+    ignored."""
+
+    regressions = []
+
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        for key in ("p50_ms", "peak_kib"):
+            before, after = baseline[name][key], result[key]
+
+            if before and after > before * (1 + tolerance):
+                regressions.append(
+                    f"{name}: {key} {before:.2f} -> {after:.2f} "
+                    f"(+{(after / before - 1) * 100:.0f}%)"
+                )
+
+    return regressions
@@ -0,0 +1,48 @@
+from invoices.xml import invoice_to_xml
+
+from .bench_rendering import get_cases
+from .factory import make_invoice
+from .runner import compare, percentile, run
+
+
+def test_factory_invoices_render_without_database():
+    xml = invoice_to_xml(make_invoice(3, accented=True, causal_length=450))
+
+    assert len(xml.findall(".//DettaglioLinee")) == 3
+    assert len(xml.findall(".//Causale")) == 3
+
+
+def test_benchmarks_run():
+    cases = [
+        case._replace(repeat=2)
+        for case in get_cases(sizes=[1], causal_lengths=[200])
+    ]
+
+    results = run(cases, verbose=False)
+
+    assert set(results) == {case.name for case in cases}
+    assert all(result["p50_ms"] > 0 for result in results.values())
+
+
+def test_percentile():
+    timings = [float(i) for i in range(1, 101)]
+
+    assert percentile(timings, 50) == 50
+    assert percentile(timings, 99) == 99
+    assert percentile([3.0], 99) == 3
+
+
+def test_compare_with_baseline():
+    baseline = {
+        "fast": {"p50_ms": 10, "peak_kib": 100},
+        "removed": {"p50_ms": 10, "peak_kib": 100},
+    }
+    results = {
+        "fast": {"p50_ms": 20, "peak_kib": 110},
+        "new": {"p50_ms": 10, "peak_kib": 100},
+    }
+
+    (regression,) = compare(results, baseline, tolerance=0.25)
+
+    assert regression.startswith("fast: p50_ms")
+    assert compare(results, baseline, tolerance=1.5) == []
@@ -1,14 +1,22 @@
 import os
-from datetime import date
+from datetime import date, timedelta
 from typing import List
 
 import pytest
 
+from invoices.managers import clear_cached_senders
 from invoices.models import Address, Invoice, Item, Sender
-from invoices.xml.types import ProductSummary
 from lxml import etree
 
 
+@pytest.fixture(autouse=True)
+def cached_senders():
+    # the ids of the rolled back rows are reused by the next tests
+    clear_cached_senders()
+    yield
+    clear_cached_senders()
+
+
 @pytest.fixture
 def user(django_user_model):
     return django_user_model.objects.create_user(
@@ -71,7 +79,7 @@ def sender(supplier_address, user):
 
 
 @pytest.fixture
-def sample_items() -> List[ProductSummary]:
+def sample_items() -> List[Item]:
     return [
         Item(
             row=1, description="item 1", quantity=1, unit_price=1.0, vat_rate=0
@@ -110,3 +118,73 @@ def sample_invoice(sender, sample_items, client_address) -> Invoice:
         invoice.items.add(item)
     invoice.save()
     return invoice
+
+
+@pytest.fixture
+def copy_invoice():
+    """Saves copies of an invoice, with a new number and progressive."""
+
+    def copy_invoice(invoice, invoice_number, items=True, **fields):
+        copy = Invoice.objects.get(pk=invoice.pk)
+        copy.pk = None
+        copy.progressive = None
+        copy.invoice_number = invoice_number
+
+        for field, value in fields.items():
+            setattr(copy, field, value)
+
+        copy.save()
+
+        if items:
+            for item in invoice.items.all():
+                item.pk = None
+                item.invoice = copy
+                item.save()
+
+        return copy
+
+    return copy_invoice
+
+
+@pytest.fixture
+def invoice_data():
+    """Builds the API data of an invoice with three items."""
+
+    def invoice_data(number, **fields):
+        data = {
+            "invoice_number": number,
+            "invoice_currency": "EUR",
+            "invoice_tax_amount": 10,
+            "transmission_format": "FPA12",
+            "recipient_address": {
+                "address": "Via Roma",
+                "postcode": "50123",
+                "city": "Florence",
+                "country_code": "IT",
+            },
+            "invoice_type": "TD01",
+            "invoice_tax_rate": 22.0,
+            "invoice_date": date.today().isoformat(),
+            "invoice_deadline": (
+                date.today() + timedelta(days=30)
+            ).isoformat(),
+            "invoice_amount": 30,
+            "recipient_code": "XXXXXXX",
+            "items": [
+                {
+                    "description": f"Item {row}",
+                    "unit_price": 10,
+                    "quantity": 1,
+                    "vat_rate": 22.0,
+                }
+                for row in (1, 2, 3)
+            ],
+            "recipient_denomination": "Example srl",
+            "payment_condition": "TP02",
+            "payment_method": "MP08",
+        }
+        data.update(fields)
+
+        return data
+
+    return invoice_data
@@ -3,9 +3,18 @@ from decimal import Decimal
 
 import pytest
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-
-from invoices.models import Invoice
+from django.utils import timezone
+
+from invoices.models import (
+    Address,
+    Invoice,
+    Item,
+    RenderedInvoice,
+    Sender,
+)
 
 
 def test_fails_with_empty_data(api_client, user):
@@ -66,6 +75,68 @@ def test_creates_with_users_sender(api_client, user, sender):
     assert item.description == "Sample item"
 
 
+def test_stores_many_lines_on_the_invoice(api_client, user, sender, settings):
+    settings.INVOICES_COMPACT_LINES_THRESHOLD = 2
+
+    api_client.force_login(user)
+
+    response = api_client.post(
+        reverse("invoice-list"),
+        {
+            "invoice_number": "1234",
+            "invoice_currency": "EUR",
+            "invoice_tax_amount": 10,
+            "transmission_format": "FPA12",
+            "recipient_address": {
+                "address": "Via Roma",
+                "postcode": "50123",
+                "city": "Florence",
+                "country_code": "IT",
+            },
+            "invoice_type": "TD01",
+            "invoice_tax_rate": 22.0,
+            "invoice_date": date.today().isoformat(),
+            "invoice_deadline": (
+                date.today() + timedelta(days=30)
+            ).isoformat(),
+            "invoice_amount": 30,
+            "recipient_code": "XXXXXXX",
+            "items": [
+                {
+                    "description": f"Item {number}",
+                    "unit_price": "10.10",
+                    "quantity": number,
+                    "vat_rate": 22.0,
+                }
+                for number in (1, 2)
+            ],
+            "recipient_denomination": "Example srl",
+            "payment_condition": "TP02",
+            "payment_method": "MP08",
+        },
+        format="json",
+    )
+
+    assert response.status_code == 201
+    assert [item["description"] for item in response.data["items"]] == [
+        "Item 1",
+        "Item 2",
+    ]
+
+    invoice = Invoice.objects.get()
+
+    assert not invoice.items.exists()
+    assert invoice.lines[1] == {
+        "row": 2,
+        "description": "Item 2",
+        "quantity": 2,
+        "unit_price": 10.1,
+        "total_price": 20.2,
+        "vat_rate": 22.0,
+    }
+    assert invoice.invoice_summary[1].unit_price == Decimal("10.10")
+
+
 def test_test_wants_both_first_and_last_name(api_client, user, sender):
     api_client.force_login(user)
 
@@ -282,13 +353,16 @@ def test_updates_invoice_when_re_uploading(api_client, user, sender):
 
     response = api_client.post(reverse("invoice-list"), data, format="json")
     assert response.status_code == 201
+    assert "fingerprint" not in response.json()["recipient_address"]
 
     data["invoice_tax_amount"] = 100
+    data["recipient_address"]["address"] = "VIA ROMA "
 
     response = api_client.post(reverse("invoice-list"), data, format="json")
     assert response.status_code == 201
 
     assert Invoice.objects.count() == 1
+    assert Address.objects.filter(city="Florence").count() == 1
     invoice = Invoice.objects.first()
 
     assert invoice.invoice_tax_amount == Decimal("100.00")
@@ -296,3 +370,361 @@ def test_updates_invoice_when_re_uploading(api_client, user, sender):
 
     item = invoice.items.first()
     assert item.description == "Sample item"
+
+
+def test_returns_the_xml_hash(api_client, user, sender):
+    api_client.force_login(user)
+
+    data = {
+        "invoice_number": "1234",
+        "invoice_currency": "EUR",
+        "invoice_tax_amount": 10,
+        "transmission_format": "FPA12",
+        "recipient_address": {
+            "address": "Via Roma",
+            "postcode": "50123",
+            "city": "Florence",
+            "country_code": "IT",
+        },
+        "invoice_type": "TD01",
+        "invoice_tax_rate": 22.0,
+        "invoice_date": date.today().isoformat(),
+        "invoice_deadline": (date.today() + timedelta(days=30)).isoformat(),
+        "invoice_amount": 30,
+        "recipient_code": "XXXXXXX",
+        "items": [
+            {
+                "description": "Sample item",
+                "unit_price": 30,
+                "quantity": 1,
+                "vat_rate": 22.0,
+            }
+        ],
+        "recipient_denomination": "Example srl",
+        "payment_condition": "TP02",
+        "payment_method": "MP08",
+    }
+
+    response = api_client.post(reverse("invoice-list"), data, format="json")
+    # the invoice is rendered when it is downloaded
+    assert response.json()["xml_sha256"] is None
+
+    xml_sha256 = Invoice.objects.get().get_rendered().sha256
+
+    response = api_client.post(reverse("invoice-list"), data, format="json")
+    assert response.json()["xml_sha256"] == xml_sha256
+
+    data["payment_method"] = "MP05"
+
+    response = api_client.post(reverse("invoice-list"), data, format="json")
+    assert response.json()["xml_sha256"] is None
+    assert not RenderedInvoice.objects.exists()
+
+
+def test_creates_many_invoices(api_client, user, sender, invoice_data):
+    api_client.force_login(user)
+
+    data = [invoice_data(f"{number:04}") for number in range(1, 11)]
+    data[-1]["recipient_address"] = {
+        "address": "Via Mugellese 1/A",
+        "postcode": "50013",
+        "city": "Campi Bisenzio",
+        "country_code": "IT",
+    }
+
+    response = api_client.post(reverse("invoice-bulk"), data, format="json")
+
+    assert response.status_code == 201
+    assert [invoice["invoice_number"] for invoice in response.data] == [
+        f"{number:04}" for number in range(1, 11)
+    ]
+
+    invoices = Invoice.objects.order_by("invoice_number")
+
+    assert [invoice.progressive for invoice in invoices] == list(range(1, 11))
+    assert Address.objects.filter(city="Florence").count() == 1
+    assert invoices[9].recipient_address.city == "Campi Bisenzio"
+
+    for invoice, returned in zip(invoices, response.data):
+        assert [item.row for item in invoice.items.order_by("row")] == [
+            1,
+            2,
+            3,
+        ]
+        # the invoices are rendered when they are downloaded
+        assert returned["xml_sha256"] is None
+
+    assert not RenderedInvoice.objects.exists()
+
+
+def test_many_invoices_are_created_with_few_queries(
+    api_client, user, sender, invoice_data
+):
+    api_client.force_login(user)
+
+    data = [invoice_data(f"{number:04}") for number in range(1, 51)]
+
+    with CaptureQueriesContext(connection) as queries:
+        response = api_client.post(
+            reverse("invoice-bulk"), data, format="json"
+        )
+
+    assert response.status_code == 201
+    assert len(queries) <= 30
+    assert Invoice.objects.count() == 50
+
+
+def test_updates_many_invoices(api_client, user, sender, invoice_data):
+    api_client.force_login(user)
+
+    api_client.post(
+        reverse("invoice-bulk"),
+        [invoice_data("0001"), invoice_data("0002")],
+        format="json",
+    )
+    first = Invoice.objects.get(invoice_number="0001")
+    first.get_rendered()
+    second = Invoice.objects.get(invoice_number="0002").get_rendered()
+
+    response = api_client.post(
+        reverse("invoice-bulk"),
+        [
+            invoice_data(
+                "0001",
+                invoice_tax_amount=100,
+                items=[
+                    {
+                        "description": "Updated item",
+                        "unit_price": 30,
+                        "quantity": 1,
+                        "vat_rate": 22.0,
+                    }
+                ],
+            ),
+            invoice_data("0002"),
+            invoice_data("0003"),
+        ],
+        format="json",
+    )
+
+    assert response.status_code == 201
+    assert Invoice.objects.count() == 3
+
+    updated = Invoice.objects.get(invoice_number="0001")
+
+    assert updated.pk == first.pk
+    assert updated.progressive == first.progressive
+    assert updated.invoice_tax_amount == Decimal("100.00")
+    assert [item.description for item in updated.items.all()] == [
+        "Updated item"
+    ]
+    assert response.data[0]["xml_sha256"] is None
+    assert response.data[1]["xml_sha256"] == second.sha256
+    assert response.data[2]["xml_sha256"] is None
+    assert Invoice.objects.get(invoice_number="0003").progressive == 3
+
+
+def test_many_invoices_are_all_or_nothing(
+    api_client, user, sender, invoice_data
+):
+    api_client.force_login(user)
+
+    invalid = invoice_data("0002", recipient_denomination="")
+    del invalid["invoice_currency"]
+
+    response = api_client.post(
+        reverse("invoice-bulk"),
+        [invoice_data("0001"), invalid, invoice_data("0003")],
+        format="json",
+    )
+
+    assert response.status_code == 400
+    assert response.json()[0] == {}
+    assert response.json()[1]["invoice_currency"] == [
+        "This field is required."
+    ]
+    assert response.json()[2] == {}
+    assert not Invoice.objects.exists()
+
+
+def test_many_invoices_have_unique_numbers(
+    api_client, user, sender, invoice_data
+):
+    api_client.force_login(user)
+
+    response = api_client.post(
+        reverse("invoice-bulk"),
+        [invoice_data("0001"), invoice_data("0002"), invoice_data("0001")],
+        format="json",
+    )
+
+    assert response.status_code == 400
+    assert response.json() == [
+        {"invoice_number": ["Duplicated invoice number."]},
+        {},
+        {"invoice_number": ["Duplicated invoice number."]},
+    ]
+    assert not Invoice.objects.exists()
+
+
+def _writes(queries):
+    return [
+        query["sql"]
+        for query in queries
+        if query["sql"].startswith(("INSERT", "UPDATE", "DELETE"))
+        # the addresses are looked up by inserting them
+        and "DO NOTHING RETURNING" not in query["sql"]
+    ]
+
+
+def test_uploading_the_same_invoice_is_a_no_op(
+    api_client, user, sender, invoice_data
+):
+    api_client.force_login(user)
+
+    data = invoice_data("0001")
+    api_client.post(reverse("invoice-list"), data, format="json")
+    rendered = Invoice.objects.get().get_rendered()
+
+    with CaptureQueriesContext(connection) as queries:
+        again = api_client.post(reverse("invoice-list"), data, format="json")
+
+    assert again.status_code == 201
+    assert again.json()["xml_sha256"] == rendered.sha256
+    assert _writes(queries) == []
+    assert RenderedInvoice.objects.get().pk == rendered.pk
+
+
+def test_re_uploading_keeps_the_unchanged_items(
+    api_client, user, sender, invoice_data
+):
+    api_client.force_login(user)
+
+    data = invoice_data("0001")
+    api_client.post(reverse("invoice-list"), data, format="json")
+    items = list(Item.objects.order_by("row"))
+
+    data["payment_method"] = "MP05"
+    data["items"][1]["description"] = "Updated item"
+    del data["items"][2]
+
+    with CaptureQueriesContext(connection) as queries:
+        again = api_client.post(reverse("invoice-list"), data, format="json")
+
+    assert again.status_code == 201
+    assert again.json()["xml_sha256"] is None
+    assert not any(
+        sql.startswith('INSERT INTO "invoices_item"')
+        for sql in _writes(queries)
+    )
+
+    invoice = Invoice.objects.get()
+
+    assert invoice.payment_method == "MP05"
+    assert list(invoice.items.order_by("row")) == items[:2]
+    assert [item.description for item in invoice.items.order_by("row")] == [
+        "Item 1",
+        "Updated item",
+    ]
+
+
+def test_re_uploading_items_only_drops_the_rendered_xml(
+    api_client, user, sender, invoice_data
+):
+    api_client.force_login(user)
+
+    data = invoice_data("0001")
+    api_client.post(reverse("invoice-list"), data, format="json")
+    invoice = Invoice.objects.get()
+    invoice.get_rendered()
+    modified = invoice.modified
+
+    data["items"].append(
+        {
+            "description": "New item",
+            "unit_price": 5,
+            "quantity": 2,
+            "vat_rate": 22.0,
+        }
+    )
+
+    response = api_client.post(reverse("invoice-list"), data, format="json")
+    invoice = Invoice.objects.get()
+
+    assert invoice.modified == modified
+    assert invoice.items.count() == 4
+    assert response.json()["xml_sha256"] is None
+    assert not RenderedInvoice.objects.exists()
+    assert b"New item" in invoice.to_xml_bytes()
+
+
+def test_bulk_re_upload_is_a_no_op(api_client, user, sender, invoice_data):
+    api_client.force_login(user)
+
+    data = [invoice_data("0001"), invoice_data("0002")]
+    api_client.post(reverse("invoice-bulk"), data, format="json")
+
+    with CaptureQueriesContext(connection) as queries:
+        response = api_client.post(
+            reverse("invoice-bulk"), data, format="json"
+        )
+
+    assert response.status_code == 201
+    assert _writes(queries) == []
+
+
+def test_concurrent_first_uploads_update_the_invoice(
+    api_client, user, sender, monkeypatch, invoice_data
+):
+    api_client.force_login(user)
+
+    data = invoice_data("0001")
+    api_client.post(reverse("invoice-list"), data, format="json")
+
+    from invoices import serializers
+
+    lock_invoice = serializers.lock_invoice
+    lookups = []
+
+    def racing_lock_invoice(sender, invoice_number):
+        # the first lookup doesn't see the invoice, as if another request
+        # created it right after
+        lookups.append(invoice_number)
+
+        if len(lookups) == 1:
+            return None
+
+        return lock_invoice(sender, invoice_number)
+
+    monkeypatch.setattr(serializers, "lock_invoice", racing_lock_invoice)
+
+    data["payment_method"] = "MP05"
+    response = api_client.post(reverse("invoice-list"), data, format="json")
+
+    assert response.status_code == 201
+    assert lookups == ["0001", "0001"]
+    assert Invoice.objects.get().payment_method == "MP05"
+
+
+def test_renders_with_the_current_sender(
+    api_client, user, sender, invoice_data
+):
+    api_client.force_login(user)
+
+    # cached by this process
+    Sender.objects.get_cached_for_user(user)
+
+    # and changed by another one
+    Sender.objects.filter(pk=sender.pk).update(
+        company_name="Python Software Foundation",
+        modified=timezone.now(),
+    )
+
+    response = api_client.post(
+        reverse("invoice-list"), invoice_data("0001"), format="json"
+    )
+
+    assert response.status_code == 201
+    assert b"Python Software Foundation" in bytes(
+        Invoice.objects.get().get_rendered().xml
+    )
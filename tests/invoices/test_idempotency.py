@@ -0,0 +1,192 @@
+from datetime import timedelta
+from io import StringIO
+
+import pytest
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from invoices.models import IdempotencyKey, Invoice
+from invoices.serializers import InvoiceSerializer
+
+
+def _post(api_client, data, key, url="invoice-list"):
+    return api_client.post(
+        reverse(url), data, format="json", HTTP_IDEMPOTENCY_KEY=key
+    )
+
+
+def test_retries_get_the_stored_response(
+    api_client, user, sender, invoice_data
+):
+    api_client.force_login(user)
+
+    data = invoice_data("0001")
+    response = _post(api_client, data, "retry-1")
+
+    assert response.status_code == 201
+
+    # the body is the same, even if formatted differently
+    data = dict(reversed(list(data.items())))
+
+    with CaptureQueriesContext(connection) as queries:
+        retry = _post(api_client, data, "retry-1")
+
+    assert retry.status_code == 201
+    assert retry.json() == response.json()
+    assert not any(
+        "invoices_invoice" in query["sql"] or "invoices_item" in query["sql"]
+        for query in queries
+    )
+    assert Invoice.objects.count() == 1
+
+
+def test_retries_of_running_requests_are_rejected(
+    api_client, user, sender, invoice_data, monkeypatch
+):
+    api_client.force_login(user)
+
+    data = invoice_data("0001")
+    create = InvoiceSerializer.create
+    retries = []
+
+    def create_and_retry(serializer, validated_data):
+        # the client retries while the first request is still running
+        retries.append(_post(api_client, data, "retry-1"))
+
+        return create(serializer, validated_data)
+
+    monkeypatch.setattr(InvoiceSerializer, "create", create_and_retry)
+    response = _post(api_client, data, "retry-1")
+
+    assert response.status_code == 201
+    assert [retry.status_code for retry in retries] == [409]
+    assert Invoice.objects.count() == 1
+
+    monkeypatch.undo()
+    retry = _post(api_client, data, "retry-1")
+
+    assert retry.status_code == 201
+    assert retry.json() == response.json()
+
+
+def test_abandoned_reservations_are_replaced(
+    api_client, user, sender, invoice_data
+):
+    api_client.force_login(user)
+
+    # left by a request that never finished
+    IdempotencyKey.objects.create(
+        user=user, key="retry-1", fingerprint="", expires=timezone.now()
+    )
+
+    response = _post(api_client, invoice_data("0001"), "retry-1")
+
+    assert response.status_code == 201
+    assert IdempotencyKey.objects.get().status_code == 201
+
+
+def test_keys_are_not_reused_for_other_requests(
+    api_client, user, sender, invoice_data
+):
+    api_client.force_login(user)
+
+    _post(api_client, invoice_data("0001"), "retry-1")
+    response = _post(api_client, invoice_data("0002"), "retry-1")
+
+    assert response.status_code == 422
+    assert Invoice.objects.count() == 1
+
+    response = _post(
+        api_client, [invoice_data("0002")], "retry-1", url="invoice-bulk"
+    )
+
+    assert response.status_code == 422
+
+
+def test_failed_requests_are_not_stored(
+    api_client, user, sender, invoice_data
+):
+    api_client.force_login(user)
+
+    invalid = invoice_data("0001")
+    del invalid["invoice_currency"]
+
+    assert _post(api_client, invalid, "retry-1").status_code == 400
+    assert not IdempotencyKey.objects.exists()
+
+    response = _post(api_client, invoice_data("0001"), "retry-1")
+
+    assert response.status_code == 201
+
+
+def test_expired_keys_are_replaced(api_client, user, sender, invoice_data):
+    api_client.force_login(user)
+
+    _post(api_client, invoice_data("0001"), "retry-1")
+    IdempotencyKey.objects.update(expires=timezone.now())
+
+    response = _post(api_client, invoice_data("0002"), "retry-1")
+
+    assert response.status_code == 201
+    assert Invoice.objects.count() == 2
+    assert IdempotencyKey.objects.get().response["invoice_number"] == "0002"
+
+
+def test_bulk_retries_get_the_stored_response(
+    api_client, user, sender, invoice_data
+):
+    api_client.force_login(user)
+
+    data = [invoice_data("0001"), invoice_data("0002")]
+    response = _post(api_client, data, "retry-1", url="invoice-bulk")
+    retry = _post(api_client, data, "retry-1", url="invoice-bulk")
+
+    assert retry.status_code == 201
+    assert retry.json() == response.json()
+
+
+def test_rejects_long_keys(api_client, user, sender, invoice_data):
+    api_client.force_login(user)
+
+    response = _post(api_client, invoice_data("0001"), "x" * 256)
+
+    assert response.status_code == 400
+    assert not Invoice.objects.exists()
+
+
+@pytest.mark.django_db
+def test_sweeps_the_expired_keys(user):
+    now = timezone.now()
+
+    for number in range(5):
+        IdempotencyKey.objects.create(
+            user=user,
+            key=f"expired-{number}",
+            fingerprint="",
+            status_code=201,
+            response={},
+            expires=now - timedelta(seconds=number),
+        )
+
+    IdempotencyKey.objects.create(
+        user=user,
+        key="valid",
+        fingerprint="",
+        status_code=201,
+        response={},
+        expires=now + timedelta(hours=1),
+    )
+
+    assert IdempotencyKey.objects.delete_expired(now, chunk_size=2) == 5
+    assert list(IdempotencyKey.objects.values_list("key", flat=True)) == [
+        "valid"
+    ]
+
+    output = StringIO()
+    call_command("sweep_idempotency_keys", stdout=output)
+
+    assert output.getvalue() == "Deleted 0 expired idempotency keys\n"
@@ -0,0 +1,190 @@
+import copy
+import os
+from datetime import date
+from decimal import Decimal
+from io import BytesIO
+
+import pytest
+
+from invoices.models import Invoice, ReceivedInvoice
+from invoices.utils import xml_to_bytes
+from invoices.xml.importer import InvoiceImportError, import_invoices
+from lxml import etree
+
+SAMPLE_FILE = os.path.join(
+    os.path.dirname(__file__), "../data/IT01234567890_FPA01.xml"
+)
+
+
+def _lot_file(numbers):
+    tree = etree.parse(SAMPLE_FILE)
+    root = tree.getroot()
+    body = root.find("FatturaElettronicaBody")
+    root.remove(body)
+
+    for number in numbers:
+        new_body = copy.deepcopy(body)
+        new_body.find("DatiGenerali/DatiGeneraliDocumento/Numero").text = (
+            number
+        )
+
+        attachment = etree.SubElement(new_body, "Allegati")
+        etree.SubElement(attachment, "NomeAttachment").text = "file.pdf"
+        etree.SubElement(attachment, "Attachment").text = "QUFB" * 1000
+
+        root.append(new_body)
+
+    return BytesIO(etree.tostring(tree))
+
+
+def _file_with_line(**values):
+    tree = etree.parse(SAMPLE_FILE)
+    line = tree.find("FatturaElettronicaBody/DatiBeniServizi/DettaglioLinee")
+
+    for tag, value in values.items():
+        line.find(tag).text = value
+
+    return BytesIO(etree.tostring(tree))
+
+
+@pytest.mark.django_db
+def test_imports_sample_file(sender):
+    (pk,) = import_invoices(SAMPLE_FILE, recipient=sender)
+
+    invoice = ReceivedInvoice.objects.get(pk=pk)
+
+    assert invoice.recipient == sender
+    assert invoice.supplier_country_code == "IT"
+    assert invoice.supplier_code == "01234567890"
+    assert invoice.supplier_denomination == "ALPHA SRL"
+    assert invoice.supplier_address.address == "VIALE ROMA 543"
+    assert invoice.supplier_address.city == "SASSARI"
+    assert invoice.invoice_number == "123"
+    assert invoice.invoice_type == "TD01"
+    assert invoice.invoice_date == date(2017, 1, 18)
+    assert invoice.invoice_deadline == date(2017, 2, 18)
+    assert invoice.invoice_amount == Decimal("5.00")
+    assert invoice.invoice_tax_amount == Decimal("1.10")
+    assert invoice.payment_condition == "TP01"
+    assert invoice.payment_method == "MP01"
+
+    (item,) = invoice.items.all()
+
+    assert item.row == 1
+    assert item.quantity == Decimal("5")
+    assert item.unit_price == Decimal("1.00")
+    assert item.total_price == Decimal("5.00")
+    assert item.vat_rate == Decimal("22.00")
+
+    assert not Invoice.objects.exists()
+
+
+@pytest.mark.django_db
+def test_joins_the_causal_chunks(sender):
+    tree = etree.parse(SAMPLE_FILE)
+    chunks = tree.findall(
+        "FatturaElettronicaBody/DatiGenerali/DatiGeneraliDocumento/Causale"
+    )
+    chunks[0].text = "A" * 199 + " "
+    chunks[1].text = "B" * 200
+
+    (pk,) = import_invoices(BytesIO(etree.tostring(tree)), recipient=sender)
+
+    causal = ReceivedInvoice.objects.get(pk=pk).causal
+
+    assert causal == "A" * 199 + " " + "B" * 200
+
+
+@pytest.mark.django_db
+def test_looks_up_the_recipient_from_the_file(sender):
+    sender.fiscal_code = "09876543210"
+    sender.save()
+
+    (pk,) = import_invoices(SAMPLE_FILE)
+
+    assert ReceivedInvoice.objects.get(pk=pk).recipient == sender
+
+
+@pytest.mark.django_db
+def test_fails_with_unknown_recipient(sender):
+    with pytest.raises(InvoiceImportError, match="Unknown recipient"):
+        import_invoices(SAMPLE_FILE)
+
+    assert not ReceivedInvoice.objects.exists()
+
+
+@pytest.mark.django_db
+def test_imports_lots(sender):
+    ids = import_invoices(_lot_file(["1", "2", "3"]), sender, batch_size=1)
+
+    invoices = ReceivedInvoice.objects.filter(pk__in=ids).order_by(
+        "invoice_number"
+    )
+
+    assert [invoice.invoice_number for invoice in invoices] == ["1", "2", "3"]
+    assert all(invoice.items.count() == 1 for invoice in invoices)
+
+
+@pytest.mark.django_db
+def test_reimport_updates_the_invoices(sender):
+    (first,) = import_invoices(SAMPLE_FILE, recipient=sender)
+    (second,) = import_invoices(SAMPLE_FILE, recipient=sender)
+
+    assert first == second
+    assert ReceivedInvoice.objects.count() == 1
+    assert ReceivedInvoice.objects.get(pk=first).items.count() == 1
+
+
+@pytest.mark.django_db
+def test_stores_fractional_quantities_exactly(sender):
+    source = _file_with_line(
+        Quantita="0.5", PrezzoUnitario="10.12345678", PrezzoTotale="5.06"
+    )
+
+    (pk,) = import_invoices(source, recipient=sender)
+
+    (item,) = ReceivedInvoice.objects.get(pk=pk).items.all()
+
+    assert item.quantity == Decimal("0.5")
+    assert item.unit_price == Decimal("10.12345678")
+    assert item.total_price == Decimal("5.06")
+
+
+@pytest.mark.django_db
+def test_rejects_amounts_that_cant_be_stored_exactly(sender):
+    source = _file_with_line(Quantita="0.123456789")
+
+    with pytest.raises(InvoiceImportError, match="Line 1: Quantita"):
+        import_invoices(source, recipient=sender)
+
+    assert not ReceivedInvoice.objects.exists()
+
+
+@pytest.mark.django_db
+def test_doesnt_touch_the_invoices_we_send(sample_invoice):
+    sender = sample_invoice.sender
+    sender.refresh_from_db()
+    last_progressive = sender.last_progressive
+
+    # a file with the same number of one of our invoices, e.g. one of ours
+    # sent back to us
+    xml = BytesIO(xml_to_bytes(sample_invoice.to_xml()))
+
+    (pk,) = import_invoices(xml, recipient=sender)
+
+    received = ReceivedInvoice.objects.get(pk=pk)
+
+    assert received.invoice_number == sample_invoice.invoice_number
+    assert received.supplier_code == sender.code
+    assert received.causal == "A" * 200 + "B" * 200
+    assert [(i.row, i.quantity) for i in received.items.order_by("row")] == [
+        (1, 1),
+        (2, 2),
+    ]
+
+    (invoice,) = Invoice.objects.all()
+    sender.refresh_from_db()
+
+    assert invoice.modified == sample_invoice.modified
+    assert invoice.progressive == sample_invoice.progressive
+    assert sender.last_progressive == last_progressive
@@ -0,0 +1,82 @@
+import logging
+
+import pytest
+
+from invoices import instrumentation
+from invoices.instrumentation import log_if_slow, measure, timer
+from invoices.utils import xml_to_bytes
+
+
+@pytest.fixture
+def enabled():
+    instrumentation.enable()
+    yield
+    instrumentation.disable()
+
+
+def test_disabled_instrumentation_does_nothing():
+    with measure("render") as breakdown:
+        assert timer("stage") is timer("other stage")
+
+    assert breakdown is None
+
+
+def test_nested_stages_are_excluded(enabled):
+    with measure("render") as breakdown:
+        with timer("outer"):
+            with timer("inner"):
+                pass
+
+            with timer("inner"):
+                pass
+
+    assert breakdown.stages["outer"].calls == 1
+    assert breakdown.stages["inner"].calls == 2
+    assert breakdown.other >= 0
+    assert breakdown.total >= (
+        breakdown.stages["outer"].seconds + breakdown.stages["inner"].seconds
+    )
+
+
+@pytest.mark.django_db
+def test_render_breakdown(enabled, sample_invoice):
+    received = []
+
+    def sink(name, breakdown):
+        received.append((name, breakdown))
+
+    instrumentation.add_sink(sink)
+
+    try:
+        with measure("render") as breakdown:
+            xml_to_bytes(sample_invoice.to_xml(validate=True))
+    finally:
+        instrumentation.remove_sink(sink)
+
+    assert received == [("render", breakdown)]
+    assert set(breakdown.as_dict()) >= {
+        "header",
+        "body",
+        "summary",
+        "build_xml",
+        "validate",
+        "serialize",
+    }
+
+
+def test_logs_slow_measurements(enabled, settings, caplog):
+    settings.INVOICES_SLOW_RENDER_SECONDS = 0
+
+    with measure("render") as breakdown:
+        with timer("stage"):
+            pass
+
+    with caplog.at_level(logging.WARNING, logger="invoices.instrumentation"):
+        log_if_slow("render", breakdown)
+
+        settings.INVOICES_SLOW_RENDER_SECONDS = 60
+        log_if_slow("render", breakdown)
+
+    (record,) = caplog.records
+    assert record.getMessage().startswith("Slow render: total=")
+    assert "stage=" in record.getMessage()
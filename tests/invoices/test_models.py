@@ -1,8 +1,27 @@
+import hashlib
 from datetime import date
+from decimal import Decimal
+from io import BytesIO
 
 import pytest
 
-from invoices.models import Address, Invoice
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from invoices.models import Address, Invoice, Item, RenderedInvoice, Sender
+from invoices.rendering import stored_invoices_xml
+from invoices.utils import xml_to_string
+from invoices.xml import invoices_to_lot_xml, invoices_to_xml
+from invoices.xml.cache import get_sender_fragments
+from invoices.xml.validation import get_schema, validate_xml
+from invoices.xml.utils import (
+    TRANSLITERATION_CACHE_SIZE,
+    configure_transliteration_cache,
+    indent,
+    transliterate,
+    transliteration_cache_info,
+)
 from lxml import etree
 
 
@@ -37,7 +56,7 @@ def test_xml_header_generation(sample_invoice):
 
     assert t_data.xpath("IdTrasmittente/IdPaese")[0].text == "IT"
     assert t_data.xpath("IdTrasmittente/IdCodice")[0].text == "PIABCDE"
-    assert t_data.xpath("ProgressivoInvio")[0].text == "1"
+    assert t_data.xpath("ProgressivoInvio")[0].text == "00001"
     assert t_data.xpath("FormatoTrasmissione")[0].text == "FPR12"
     assert t_data.xpath("CodiceDestinatario")[0].text == "ABCDEFG"
     assert len(t_data.xpath("PecDestinatario")) == 0
@@ -153,9 +172,10 @@ def test_xml_body_generation(sample_invoice):
     assert second_item.xpath("PrezzoTotale")[0].text == "4.00"
     assert second_item.xpath("AliquotaIVA")[0].text == "0.00"
 
-    assert summary.xpath("DatiRiepilogo/AliquotaIVA")[0].text == "22.00"
-    assert summary.xpath("DatiRiepilogo/ImponibileImporto")[0].text == "2.00"
-    assert summary.xpath("DatiRiepilogo/Imposta")[0].text == "0.44"
+    assert len(summary.xpath("DatiRiepilogo")) == 1
+    assert summary.xpath("DatiRiepilogo/AliquotaIVA")[0].text == "0.00"
+    assert summary.xpath("DatiRiepilogo/ImponibileImporto")[0].text == "5.00"
+    assert summary.xpath("DatiRiepilogo/Imposta")[0].text == "0.00"
 
     # Payment data
 
@@ -169,6 +189,86 @@ def test_xml_body_generation(sample_invoice):
     assert details.xpath("ImportoPagamento")[0].text == "2.00"
 
 
+@pytest.mark.django_db
+def test_vat_summary_by_rate(sample_invoice, django_assert_num_queries):
+    for row, (unit_price, vat_rate) in enumerate(
+        [("10.00", 22), ("0.05", 22), ("3.33", 10)], start=3
+    ):
+        Item.objects.create(
+            row=row,
+            description=f"item {row}",
+            quantity=3,
+            unit_price=Decimal(unit_price),
+            vat_rate=vat_rate,
+            invoice=sample_invoice,
+        )
+
+    with django_assert_num_queries(1):
+        summary = sample_invoice.vat_summary
+
+    assert summary == [
+        (Decimal("0.00"), Decimal("5.00"), Decimal("0.00")),
+        (Decimal("10.00"), Decimal("9.99"), Decimal("1.00")),
+        (Decimal("22.00"), Decimal("30.15"), Decimal("6.63")),
+    ]
+
+    xml = sample_invoice.to_xml(validate=True)
+
+    assert [
+        tag.text for tag in xml.iterfind(".//DatiRiepilogo/AliquotaIVA")
+    ] == ["0.00", "10.00", "22.00"]
+    assert [tag.text for tag in xml.iterfind(".//DatiRiepilogo/Imposta")] == [
+        "0.00",
+        "1.00",
+        "6.63",
+    ]
+
+
+@pytest.mark.django_db
+def test_xml_of_invoice_with_lines(sample_invoice):
+    expected = xml_to_string(sample_invoice.to_xml())
+
+    sample_invoice.lines = [
+        line.to_json() for line in sample_invoice.invoice_summary
+    ]
+    sample_invoice.save()
+    sample_invoice.items.all().delete()
+
+    invoice = Invoice.objects.get(pk=sample_invoice.pk)
+
+    assert xml_to_string(invoice.to_xml()) == expected
+
+    stream = BytesIO()
+    invoice.to_xml_stream(stream)
+
+    assert stream.getvalue().decode("utf-8") == expected
+    assert next(invoices_to_xml(Invoice.objects.all()))[1].decode() == (
+        expected
+    )
+
+
+@pytest.mark.django_db
+def test_lines_are_validated(sample_invoice):
+    sample_invoice.lines = [{"row": 1, "description": "No prices"}]
+
+    with pytest.raises(ValidationError):
+        sample_invoice.full_clean()
+
+
+@pytest.mark.django_db
+def test_vat_summaries_of_many_invoices(sample_invoice, copy_invoice):
+    empty = copy_invoice(sample_invoice, "00002A", items=False)
+
+    summaries = Item.objects.vat_summaries([sample_invoice.pk, empty.pk])
+
+    assert summaries == {
+        sample_invoice.pk: [
+            (Decimal("0.00"), Decimal("5.00"), Decimal("0.00"))
+        ],
+        empty.pk: [],
+    }
+
+
 def test_address_string():
     ad1 = Address(
         address="Via dei matti, 0",
@@ -190,12 +290,148 @@ def test_address_string():
     assert str(ad3) == "Via Roma, 9 Treviglio (BG) [IT]"
 
 
+@pytest.mark.django_db
+def test_address_fingerprint_ignores_case_and_spaces(client_address):
+    address, created = Address.objects.get_or_create_by_fingerprint(
+        address=" via  ROMA 1",
+        city="avellino",
+        postcode="83100",
+        province="av",
+        country_code="IT",
+    )
+
+    assert not created
+    assert address == client_address
+    assert Address.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_address_is_created_by_fingerprint(client_address):
+    address, created = Address.objects.get_or_create_by_fingerprint(
+        address="Via Roma 2",
+        city="Avellino",
+        postcode="83100",
+        country_code="IT",
+    )
+
+    assert created
+    assert address.pk != client_address.pk
+    assert address.province == ""
+    assert Address.objects.get(pk=address.pk).fingerprint == (
+        address.fingerprint
+    )
+
+
+@pytest.mark.django_db
+def test_many_addresses_are_created_at_once(
+    client_address, django_assert_num_queries
+):
+    addresses = [
+        {"address": f"Via Roma {number}", "city": "Avellino"}
+        for number in (2, 3, 2, 1, 4)
+    ]
+
+    for fields in addresses:
+        fields.update(postcode="83100", country_code="IT")
+
+    addresses[3]["province"] = "AV"
+
+    with django_assert_num_queries(2):
+        found = Address.objects.get_or_create_many_by_fingerprint(addresses)
+
+    assert found[3] == client_address
+    assert found[0].pk == found[2].pk
+    assert len({address.pk for address in found}) == 4
+    assert [address.address for address in found] == [
+        "Via Roma 2",
+        "Via Roma 3",
+        "Via Roma 2",
+        "Via Roma 1",
+        "Via Roma 4",
+    ]
+    assert Address.objects.count() == 4
+
+
+@pytest.mark.django_db
+def test_duplicate_address_is_not_valid(client_address):
+    address = Address(
+        address="VIA ROMA 1",
+        city="Avellino",
+        postcode="83100",
+        province="AV",
+        country_code="IT",
+    )
+
+    with pytest.raises(ValidationError):
+        address.full_clean()
+
+    with pytest.raises(IntegrityError), transaction.atomic():
+        address.save()
+
+
+@pytest.mark.django_db
+def test_sender_is_cached(sender, user, django_assert_num_queries):
+    with django_assert_num_queries(1):
+        cached = Sender.objects.get_cached_for_user(user)
+        assert cached.address.city == "Campi Bisenzio"
+
+    with django_assert_num_queries(0):
+        assert Sender.objects.get_cached_for_user(user) is cached
+
+
+@pytest.mark.django_db
+def test_cached_sender_is_invalidated(sender, user):
+    cached = Sender.objects.get_cached_for_user(user)
+
+    sender.company_name = "Another company"
+    sender.save()
+
+    assert Sender.objects.get_cached_for_user(user) is not cached
+
+    sender.address.city = "Firenze"
+    sender.address.save()
+
+    assert Sender.objects.get_cached_for_user(user).address.city == "Firenze"
+
+
+@pytest.mark.django_db
+def test_cached_sender_expires(sender, user, settings):
+    settings.INVOICES_SENDER_CACHE_TTL = 0
+
+    cached = Sender.objects.get_cached_for_user(user)
+
+    assert Sender.objects.get_cached_for_user(user) is not cached
+
+
+@pytest.mark.django_db
+def test_sender_cache_is_bounded(
+    sender, user, supplier_address, django_user_model, settings
+):
+    settings.INVOICES_SENDER_CACHE_SIZE = 1
+
+    other_user = django_user_model.objects.create_user(username="other")
+    Sender.objects.create(
+        name="Other",
+        code="OTHER",
+        country_code="IT",
+        company_name="Other srl",
+        tax_regime="RF01",
+        address=supplier_address,
+        user=other_user,
+    )
+
+    cached = Sender.objects.get_cached_for_user(user)
+    Sender.objects.get_cached_for_user(other_user)
+
+    assert Sender.objects.get_cached_for_user(user) is not cached
+
+
 @pytest.mark.django_db
 def test_invoice_string(sample_invoice):
     assert str(sample_invoice) == "[Fattura/00001A] Patrick A: " + (
         "A" * 200 + "B" * 200
     )
-    assert sample_invoice.get_filename() == "00001A.xml"
+    assert sample_invoice.get_filename() == "ITPIABCDE_00001.xml"
 
 
 @pytest.mark.django_db
@@ -222,3 +458,302 @@ def test_xml_encoding(sample_invoice):
     )[0]
 
     assert name.text == "Lukasz"
+
+
+@pytest.mark.django_db
+def test_xml_stream_matches_xml(sample_invoice):
+    sample_invoice.recipient_first_name = "Łukasz"
+
+    for row in range(3, 50):
+        Item.objects.create(
+            row=row,
+            description=f"item {row} è",
+            quantity=row,
+            unit_price=1.5,
+            vat_rate=22,
+            invoice=sample_invoice,
+        )
+
+    output = BytesIO()
+    sample_invoice.to_xml_stream(output)
+
+    expected = xml_to_string(sample_invoice.to_xml()).encode("utf-8")
+
+    assert output.getvalue() == expected
+
+
+@pytest.mark.django_db
+def test_sender_fragments_are_cached(sample_invoice, sender):
+    fragments = get_sender_fragments(sender)
+
+    assert get_sender_fragments(sender) is fragments
+
+    # the cached tags are copied in the document, not moved
+    sample_invoice.to_xml()
+    sample_invoice.to_xml()
+
+    assert fragments.cedente_prestatore.getparent() is None
+
+
+@pytest.mark.django_db
+def test_sender_fragments_are_invalidated(
+    sample_invoice, sender, supplier_address
+):
+    get_sender_fragments(sender)
+
+    supplier_address.city = "Firenze"
+    supplier_address.save()
+
+    invoice = Invoice.objects.get(pk=sample_invoice.pk)
+    city = invoice.to_xml().xpath(
+        "FatturaElettronicaHeader/CedentePrestatore/Sede/Comune"
+    )[0]
+
+    assert city.text == "Firenze"
+
+    invoice.sender.company_name = "Python Italia"
+    invoice.sender.save()
+
+    name = invoice.to_xml().xpath(
+        "FatturaElettronicaHeader/CedentePrestatore/DatiAnagrafici"
+        "/Anagrafica/Denominazione"
+    )[0]
+
+    assert name.text == "Python Italia"
+
+
+def test_transliteration_cache():
+    configure_transliteration_cache(2)
+
+    try:
+        assert transliterate("Via Roma 1") == b"Via Roma 1"
+        assert transliteration_cache_info().misses == 0
+
+        assert transliterate("Łukasz") == b"Lukasz"
+        assert transliterate("Łukasz") == b"Lukasz"
+        assert transliterate("Niccolò") == b"Niccolo"
+        assert transliterate("Forlì") == b"Forli"
+
+        info = transliteration_cache_info()
+
+        assert (info.hits, info.misses, info.currsize) == (1, 3, 2)
+    finally:
+        configure_transliteration_cache(TRANSLITERATION_CACHE_SIZE)
+
+
+@pytest.mark.django_db
+def test_xml_is_valid(sample_invoice):
+    sample_invoice.validate_xml()
+
+    assert sample_invoice.to_xml(validate=True) is not None
+
+
+@pytest.mark.django_db
+def test_xml_validation_fails(sample_invoice):
+    sample_invoice.recipient_code = "abc"
+
+    with pytest.raises(etree.DocumentInvalid):
+        sample_invoice.validate_xml()
+
+    with pytest.raises(etree.DocumentInvalid):
+        sample_invoice.to_xml(validate=True)
+
+
+def test_schema_is_compiled_once():
+    assert get_schema() is get_schema()
+
+
+@pytest.mark.django_db
+def test_invoices_to_xml(
+    sample_invoice, django_assert_num_queries, copy_invoice
+):
+    expected = xml_to_string(sample_invoice.to_xml()).encode("utf-8")
+
+    for number in range(2, 6):
+        copy_invoice(sample_invoice, f"{number:05}A")
+
+    with django_assert_num_queries(3):
+        files = list(invoices_to_xml(Invoice.objects.order_by("pk")))
+
+    assert len(files) == 5
+    assert files[0] == ("ITPIABCDE_00001.xml", expected)
+    assert files[1][0] == "ITPIABCDE_00002.xml"
+    assert files[1][1] == expected.replace(b"00001A", b"00002A").replace(
+        b">00001<", b">00002<"
+    )
+
+
+@pytest.mark.django_db
+def test_invoices_to_lot_xml(sample_invoice, copy_invoice):
+    for number in ("00002A", "00003A"):
+        copy_invoice(sample_invoice, number)
+
+    output = BytesIO()
+    invoices_to_lot_xml(Invoice.objects.order_by("pk"), output)
+
+    xml = etree.fromstring(output.getvalue())
+    validate_xml(xml)
+
+    assert len(xml.findall("FatturaElettronicaHeader")) == 1
+    assert [
+        number.text
+        for number in xml.iterfind(
+            "FatturaElettronicaBody/DatiGenerali/DatiGeneraliDocumento/Numero"
+        )
+    ] == ["00001A", "00002A", "00003A"]
+
+
+@pytest.mark.django_db
+def test_lot_with_one_invoice_matches_xml(sample_invoice):
+    output = BytesIO()
+    invoices_to_lot_xml([sample_invoice], output)
+
+    expected = xml_to_string(sample_invoice.to_xml()).encode("utf-8")
+
+    assert output.getvalue() == expected
+
+
+@pytest.mark.django_db
+def test_lot_requires_same_recipient(sample_invoice, copy_invoice):
+    other = copy_invoice(sample_invoice, "00002A")
+    other.recipient_tax_code = "BBBAAA12B34Z123D"
+
+    with pytest.raises(ValueError):
+        invoices_to_lot_xml([sample_invoice, other], BytesIO())
+
+    with pytest.raises(ValueError):
+        invoices_to_lot_xml([], BytesIO())
+
+
+@pytest.mark.django_db
+def test_invoice_numbers_are_unique_per_sender(sample_invoice):
+    duplicate = Invoice.objects.get(pk=sample_invoice.pk)
+    duplicate.pk = None
+
+    with pytest.raises(IntegrityError), transaction.atomic():
+        duplicate.save()
+
+
+@pytest.mark.django_db
+def test_rendered_xml_is_stored(sample_invoice, django_assert_num_queries):
+    xml = sample_invoice.to_xml_bytes()
+
+    assert xml == xml_to_string(sample_invoice.to_xml()).encode("utf-8")
+
+    rendered = RenderedInvoice.objects.get(invoice=sample_invoice)
+
+    assert rendered.sha256 == hashlib.sha256(xml).hexdigest()
+
+    invoice = Invoice.objects.get(pk=sample_invoice.pk)
+
+    with django_assert_num_queries(1):
+        assert invoice.to_xml_bytes() == xml
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "change",
+    [
+        lambda invoice: invoice.save(),
+        lambda invoice: invoice.items.first().save(),
+        lambda invoice: invoice.items.first().delete(),
+        lambda invoice: invoice.recipient_address.save(),
+        lambda invoice: invoice.sender.address.save(),
+        lambda invoice: invoice.sender.save(),
+    ],
+)
+def test_rendered_xml_is_invalidated(sample_invoice, change):
+    sample_invoice.to_xml_bytes()
+
+    change(Invoice.objects.get(pk=sample_invoice.pk))
+
+    assert not RenderedInvoice.objects.exists()
+
+
+@pytest.mark.django_db
+def test_items_are_deleted_at_once(sample_invoice):
+    fields = {"quantity": 1, "unit_price": Decimal("1.00"), "vat_rate": 0}
+    items = [dict(fields, description=f"item {row}") for row in range(50)]
+
+    Item.objects.sync(sample_invoice, items)
+    sample_invoice.to_xml_bytes()
+
+    with CaptureQueriesContext(connection) as queries:
+        assert Item.objects.sync(sample_invoice, items[:10])
+
+    deletes = [q["sql"] for q in queries if q["sql"].startswith("DELETE")]
+
+    assert len(deletes) == 1
+    assert "invoices_item" in deletes[0]
+    assert sample_invoice.items.count() == 10
+
+    with CaptureQueriesContext(connection) as queries:
+        sample_invoice.delete()
+
+    assert len(queries) <= 5
+    assert not Item.objects.exists()
+    assert not RenderedInvoice.objects.exists()
+
+
+@pytest.mark.django_db
+def test_stored_invoices_xml(sample_invoice, django_assert_num_queries):
+    expected = sample_invoice.to_xml_bytes()
+
+    with django_assert_num_queries(1):
+        files = stored_invoices_xml(Invoice.objects.all())
+
+    assert files == [("ITPIABCDE_00001.xml", expected)]
+
+    RenderedInvoice.objects.all().delete()
+
+    assert stored_invoices_xml(Invoice.objects.all()) == files
+    assert RenderedInvoice.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_items_are_synced_by_row(sample_invoice, monkeypatch):
+    monkeypatch.setattr("invoices.managers.UPDATE_BATCH_SIZE", 1)
+    first, second = sample_invoice.items.order_by("row")
+    fields = {"quantity": 1, "unit_price": Decimal("1.00"), "vat_rate": 0}
+
+    assert not Item.objects.sync(
+        sample_invoice,
+        [
+            dict(fields, description="item 1"),
+            dict(fields, description="item 2", quantity=2, unit_price=2),
+        ],
+    )
+    assert Item.objects.sync(
+        sample_invoice,
+        [
+            dict(fields, description="item 1", quantity=3),
+            dict(fields, description="changed", unit_price=Decimal("4.5")),
+            dict(fields, description="item 3"),
+        ],
+    )
+
+    items = list(sample_invoice.items.order_by("row"))
+
+    assert [item.pk for item in items[:2]] == [first.pk, second.pk]
+    assert [
+        (item.row, item.description, item.quantity, item.unit_price)
+        for item in items
+    ] == [
+        (1, "item 1", 3, Decimal("1.00")),
+        (2, "changed", 1, Decimal("4.50")),
+        (3, "item 3", 1, Decimal("1.00")),
+    ]
+
+    assert Item.objects.sync(sample_invoice, [])
+    assert not sample_invoice.items.exists()
+
+
+def test_indent_matches_pretty_print():
+    tree = etree.fromstring(
+        b"<a><b><c>1</c><c>2</c></b><d/><e>text</e></a>",
+    )
+    expected = etree.tostring(tree, pretty_print=True).rstrip(b"\n")
+
+    indent(tree)
+
+    assert etree.tostring(tree) == expected
@@ -0,0 +1,125 @@
+import threading
+from datetime import date
+from importlib import import_module
+from types import SimpleNamespace
+
+import pytest
+from django.apps import apps
+from django.db import IntegrityError, connection, transaction
+
+from invoices.models import Invoice, Sender
+from invoices.progressive import (
+    MAX_PROGRESSIVE,
+    allocate_progressive,
+    format_progressive,
+)
+
+migration = import_module("invoices.migrations.0027_progressive")
+
+
+@pytest.mark.parametrize(
+    "number,expected",
+    [(1, "00001"), (35, "0000Z"), (36, "00010"), (MAX_PROGRESSIVE, "ZZZZZ")],
+)
+def test_format_progressive(number, expected):
+    assert format_progressive(number) == expected
+
+
+@pytest.mark.parametrize("number", [0, -1, MAX_PROGRESSIVE + 1])
+def test_format_progressive_out_of_range(number):
+    with pytest.raises(ValueError):
+        format_progressive(number)
+
+
+@pytest.mark.django_db
+def test_progressives_are_allocated_per_sender(sample_invoice, copy_invoice):
+    assert sample_invoice.progressive == 1
+
+    copy = copy_invoice(sample_invoice, "00002A")
+
+    assert copy.progressive == 2
+    assert copy.get_filename() == "ITPIABCDE_00002.xml"
+
+
+@pytest.mark.django_db
+def test_progressive_is_kept_on_save(sample_invoice):
+    sample_invoice.causal = "Updated"
+    sample_invoice.save()
+    sample_invoice.refresh_from_db()
+
+    assert sample_invoice.progressive == 1
+
+
+@pytest.mark.django_db
+def test_migration_numbers_the_invoices_by_date(sample_invoice, copy_invoice):
+    dates = [date(2019, 6, 17), date(2019, 1, 1), date(2019, 6, 16)]
+
+    for number, invoice_date in enumerate(dates, 2):
+        copy_invoice(
+            sample_invoice, f"0000{number}A", invoice_date=invoice_date
+        )
+
+    Invoice.objects.update(progressive=None)
+
+    migration.number_invoices(apps, SimpleNamespace(connection=connection))
+
+    assert list(
+        Invoice.objects.order_by("progressive").values_list(
+            "invoice_number", "progressive"
+        )
+    ) == [("00003A", 1), ("00001A", 2), ("00004A", 3), ("00002A", 4)]
+    assert Sender.objects.get().last_progressive == 4
+
+
+@pytest.mark.django_db
+def test_rolled_back_progressives_are_taken_again(
+    sample_invoice, copy_invoice
+):
+    invoice = Invoice.objects.get(pk=sample_invoice.pk)
+    invoice.pk = None
+    invoice.progressive = None
+
+    # the number is already used by the sender
+    with pytest.raises(IntegrityError):
+        invoice.save()
+
+    assert invoice.progressive is None
+    assert copy_invoice(sample_invoice, "00002A").progressive == 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_allocations_have_no_gaps_or_duplicates(sender):
+    threads, allocations = 8, 25
+    allocated = []
+    lock = threading.Lock()
+
+    def allocate():
+        try:
+            for allocation in range(allocations):
+                try:
+                    with transaction.atomic():
+                        number = allocate_progressive("default", sender.pk)
+
+                        # some of the invoices fail to be stored
+                        if allocation % 5 == 0:
+                            raise IntegrityError
+
+                    with lock:
+                        allocated.append(number)
+                except IntegrityError:
+                    pass
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=allocate) for _ in range(threads)]
+
+    for worker in workers:
+        worker.start()
+
+    for worker in workers:
+        worker.join()
+
+    committed = threads * allocations * 4 // 5
+
+    assert sorted(allocated) == list(range(1, committed + 1))
+    assert Sender.objects.get().last_progressive == committed
@@ -0,0 +1,60 @@
+import zipfile
+
+import pytest
+
+from django.core.management import call_command
+from django.db import connection
+
+from invoices.models import Invoice
+from invoices.rendering import render_invoices
+from invoices.utils import xml_to_bytes
+
+
+@pytest.mark.django_db
+def test_render_invoices_keeps_the_order(sample_invoice, copy_invoice):
+    invoices = [
+        copy_invoice(sample_invoice, f"{number:05}A") for number in range(2, 7)
+    ]
+    invoices.insert(3, sample_invoice)
+
+    ids = [invoice.pk for invoice in reversed(invoices)]
+
+    files = list(render_invoices(ids, workers=1, chunk_size=4))
+
+    assert [filename for filename, _ in files] == [
+        invoice.get_filename() for invoice in reversed(invoices)
+    ]
+    assert files[2][1] == xml_to_bytes(sample_invoice.to_xml())
+
+
+@pytest.mark.django_db
+def test_export_invoices_command(sample_invoice, tmp_path, copy_invoice):
+    copy_invoice(sample_invoice, "00002A")
+
+    output = tmp_path / "invoices.zip"
+
+    call_command("export_invoices", str(output), "--workers=1")
+
+    with zipfile.ZipFile(output) as archive:
+        assert sorted(archive.namelist()) == [
+            "ITPIABCDE_00001.xml",
+            "ITPIABCDE_00002.xml",
+        ]
+
+
+@pytest.mark.skipif(
+    connection.vendor == "sqlite",
+    reason="workers can't see the in-memory test database",
+)
+@pytest.mark.django_db(transaction=True)
+def test_render_invoices_in_processes(sample_invoice, copy_invoice):
+    copy_invoice(sample_invoice, "00002A")
+
+    ids = list(Invoice.objects.order_by("pk").values_list("pk", flat=True))
+
+    files = list(render_invoices(ids, workers=2, chunk_size=1))
+
+    assert [filename for filename, _ in files] == [
+        "ITPIABCDE_00001.xml",
+        "ITPIABCDE_00002.xml",
+    ]
@@ -0,0 +1,88 @@
+import pytest
+
+from invoices.models import Invoice
+from invoices.routers import (
+    ReplicaRouter,
+    read_from_primary,
+    read_from_replica,
+    reset,
+)
+from invoices.signals import request_boundary
+
+
+@pytest.fixture
+def replicas(settings):
+    settings.DATABASE_REPLICAS = ["replica_0"]
+
+    reset()
+    yield settings.DATABASE_REPLICAS
+    reset()
+
+
+def test_reads_from_the_primary_by_default(replicas):
+    assert ReplicaRouter().db_for_read(Invoice) == "default"
+
+
+def test_reads_from_the_primary_without_replicas(settings):
+    settings.DATABASE_REPLICAS = []
+
+    with read_from_replica():
+        assert ReplicaRouter().db_for_read(Invoice) == "default"
+
+
+def test_reads_from_a_replica(replicas):
+    router = ReplicaRouter()
+
+    with read_from_replica():
+        with read_from_replica():
+            assert router.db_for_read(Invoice) == "replica_0"
+
+        assert router.db_for_read(Invoice) == "replica_0"
+
+    assert router.db_for_read(Invoice) == "default"
+
+
+def test_reads_from_the_same_replica_in_a_block(replicas):
+    replicas[:] = [f"replica_{number}" for number in range(10)]
+    router = ReplicaRouter()
+
+    with read_from_replica():
+        aliases = {router.db_for_read(Invoice) for _ in range(20)}
+
+        with read_from_replica():
+            aliases.add(router.db_for_read(Invoice))
+
+    assert len(aliases) == 1
+    assert aliases <= set(replicas)
+
+
+def test_reads_from_the_primary_in_read_from_primary(replicas):
+    router = ReplicaRouter()
+
+    with read_from_replica():
+        with read_from_primary():
+            assert router.db_for_read(Invoice) == "default"
+
+        assert router.db_for_read(Invoice) == "replica_0"
+
+
+def test_reads_from_the_primary_after_a_write(replicas):
+    router = ReplicaRouter()
+
+    assert router.db_for_write(Invoice) == "default"
+
+    with read_from_replica():
+        assert router.db_for_read(Invoice) == "default"
+
+    # a new request
+    request_boundary(sender=None)
+
+    with read_from_replica():
+        assert router.db_for_read(Invoice) == "replica_0"
+
+
+def test_replicas_are_not_migrated(replicas):
+    router = ReplicaRouter()
+
+    assert router.allow_migrate("default", "invoices")
+    assert not router.allow_migrate("replica_0", "invoices")
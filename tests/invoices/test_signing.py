@@ -0,0 +1,134 @@
+import base64
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.hazmat.primitives.serialization import pkcs7
+from invoices.rendering import render_invoices
+from invoices.signing import (
+    CADES,
+    DS,
+    XADES,
+    clear_signing_material,
+    get_signing_material,
+)
+from invoices.utils import xml_to_bytes
+from invoices.xml.validation import validate_xml
+from lxml import etree
+
+
+def _certificate(subject, issuer, public_key, signing_key):
+    now = datetime.now(timezone.utc)
+
+    return (
+        x509.CertificateBuilder()
+        .subject_name(
+            x509.Name([x509.NameAttribute(x509.OID_COMMON_NAME, subject)])
+        )
+        .issuer_name(
+            x509.Name([x509.NameAttribute(x509.OID_COMMON_NAME, issuer)])
+        )
+        .public_key(public_key)
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=1))
+        .sign(signing_key, hashes.SHA256())
+    )
+
+
+@pytest.fixture
+def signing_material(settings, tmp_path):
+    ca_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    ca = _certificate("Test CA", "Test CA", ca_key.public_key(), ca_key)
+    certificate = _certificate("Signer", "Test CA", key.public_key(), ca_key)
+
+    key_path = tmp_path / "key.pem"
+    key_path.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.BestAvailableEncryption(b"secret"),
+        )
+    )
+
+    certificates_path = tmp_path / "certificates.pem"
+    certificates_path.write_bytes(
+        certificate.public_bytes(serialization.Encoding.PEM)
+        + ca.public_bytes(serialization.Encoding.PEM)
+    )
+
+    settings.INVOICES_SIGNING_KEY = str(key_path)
+    settings.INVOICES_SIGNING_KEY_PASSWORD = "secret"
+    settings.INVOICES_SIGNING_CERTIFICATES = str(certificates_path)
+
+    clear_signing_material()
+    yield get_signing_material()
+    clear_signing_material()
+
+
+def _digest(data):
+    return base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+
+def _c14n(element):
+    return etree.tostring(element, method="c14n")
+
+
+def test_signing_material_is_loaded_once(signing_material):
+    assert get_signing_material() is signing_material
+    assert len(signing_material.certificates) == 2
+
+
+@pytest.mark.django_db
+def test_xades_signature(sample_invoice, signing_material):
+    ((filename, signed),) = render_invoices(
+        [sample_invoice.pk], workers=1, signature=XADES
+    )
+
+    assert filename == "ITPIABCDE_00001.xml"
+
+    xml = etree.fromstring(signed)
+    validate_xml(xml)
+
+    signature = xml.find(f"{{{DS}}}Signature")
+    signed_info = signature.find(f"{{{DS}}}SignedInfo")
+    document, signed_properties = signed_info.findall(f"{{{DS}}}Reference")
+
+    (properties,) = signature.xpath(
+        "//*[@Id=$id]", id=signed_properties.get("URI")[1:]
+    )
+    assert signed_properties.findtext(f"{{{DS}}}DigestValue") == _digest(
+        _c14n(properties)
+    )
+
+    signing_material.certificates[0].public_key().verify(
+        base64.b64decode(signature.findtext(f"{{{DS}}}SignatureValue")),
+        _c14n(signed_info),
+        padding.PKCS1v15(),
+        hashes.SHA256(),
+    )
+
+    xml.remove(signature)
+
+    assert document.findtext(f"{{{DS}}}DigestValue") == _digest(_c14n(xml))
+    assert xml_to_bytes(xml) == xml_to_bytes(sample_invoice.to_xml())
+
+
+@pytest.mark.django_db
+def test_cades_signature(sample_invoice, signing_material):
+    ((filename, signed),) = render_invoices(
+        [sample_invoice.pk], workers=1, signature=CADES
+    )
+
+    assert filename == "ITPIABCDE_00001.xml.p7m"
+    assert xml_to_bytes(sample_invoice.to_xml()) in signed
+    assert (
+        pkcs7.load_der_pkcs7_certificates(signed)
+        == signing_material.certificates
+    )